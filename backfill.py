@@ -0,0 +1,376 @@
+"""
+Sir Peepius Backfill
+Drains a large backlog of unread target mail (e.g. after an outage) in
+batches instead of one completion at a time:
+
+1. The backlog's UIDs are snapshotted once, with each sender and subject.
+2. Bodies are fetched BATCH_SIZE at a time, and each set of completion
+   requests is submitted as one batch.
+3. Replies are sent as the results come back.
+
+Every step is recorded in a SQLite checkpoint, so a restarted run resumes
+exactly where the last one stopped. Batches still running are polled
+again. A message that a batch fails to answer (lost, failed, expired) is
+resubmitted, but after max_attempts tries it is marked failed. Each reply
+is sent at most once: a reply interrupted mid-send is marked failed
+rather than sent twice.
+
+Batch backends share one small interface: submit(requests) -> batch_id,
+and collect(batch_id) -> (state, {custom_id: text or Exception}), where
+state is "running", "done" or "lost". OpenAIBatchClient uses the
+OpenAI Batch API. LocalBatchClient is a local stand-in for it that runs
+the requests on a thread pool and hands results back as each one finishes.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from imap_fetch import fetch_headers, iter_text_bodies, mark_answered
+from mime_body import parse_message, extract_body
+from reply_parser import clean_reply_text
+
+DEFAULT_CHECKPOINT_FILE = os.path.join(tempfile.gettempdir(), "sir_peepius_backfill.db")
+
+
+class BatchFailed(RuntimeError):
+    """The batch endpoint gave up on a whole batch (as opposed to a hiccup while polling it)."""
+
+
+class LocalBatchClient:
+    """Stand-in batch endpoint: complete(request) runs on a thread pool; results are collected as they finish."""
+
+    def __init__(self, complete, workers=8):
+        self.complete = complete
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill")
+        self._lock = threading.Lock()
+        self._batches = {}  # batch_id -> {custom_id: future}
+        self._ids = 0
+
+    def submit(self, requests):
+        with self._lock:
+            self._ids += 1
+            batch_id = f"local-{int(time.time() * 1000)}-{self._ids}"
+            self._batches[batch_id] = {r["custom_id"]: self._pool.submit(self.complete, r["body"]) for r in requests}
+        return batch_id
+
+    def collect(self, batch_id):
+        with self._lock:
+            futures = self._batches.get(batch_id)
+            if futures is None:
+                return "lost", {}  # Submitted by an earlier process
+            finished = {cid: f for cid, f in futures.items() if f.done()}
+            for cid in finished:
+                del futures[cid]
+            if not futures:
+                del self._batches[batch_id]
+        results = {cid: f.exception() or f.result() for cid, f in finished.items()}
+        return ("running" if futures else "done"), results
+
+
+class OpenAIBatchClient:
+    """The OpenAI Batch API (/v1/chat/completions, 24h window): cheaper, but results arrive all at once."""
+
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, requests):
+        lines = [json.dumps({"custom_id": r["custom_id"], "method": "POST",
+                             "url": "/v1/chat/completions", "body": r["body"]}) for r in requests]
+        upload = self.client.files.create(file=("backfill.jsonl", "\n".join(lines).encode()), purpose="batch")
+        batch = self.client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions",
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def _read(self, file_id, results):
+        if not file_id:
+            return
+        for line in self.client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            response = row.get("response") or {}
+            if row.get("error") or response.get("status_code") != 200:
+                results[row["custom_id"]] = RuntimeError(str(row.get("error") or response.get("body")))
+            else:
+                results[row["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+
+    def collect(self, batch_id):
+        try:
+            batch = self.client.batches.retrieve(batch_id)
+        except Exception as e:
+            if getattr(e, "status_code", None) == 404:
+                return "lost", {}
+            raise
+        if batch.status == "failed":
+            raise BatchFailed(f"batch {batch_id} failed: {batch.errors}")
+        if batch.status not in ("completed", "expired", "cancelled"):
+            return "running", {}
+        results = {}
+        self._read(batch.output_file_id, results)
+        self._read(batch.error_file_id, results)
+        return "done", results
+
+
+class BackfillCheckpoint:
+    """
+    SQLite record of one backfill: the UID snapshot (with its UIDVALIDITY)
+    and each message's state: pending → submitted → sending → replied,
+    or failed / skipped.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " uid INTEGER PRIMARY KEY,"
+            " sender TEXT NOT NULL,"
+            " subject TEXT NOT NULL,"
+            " message_id TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " batch_id TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS messages_state ON messages (state, uid);"
+            "CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, submitted_at REAL NOT NULL);"
+        )
+        self._db.commit()
+
+    def unfinished(self):
+        """(True, UIDVALIDITY) for an unfinished snapshot to resume, else (False, None)."""
+        with self._lock:
+            meta = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        if "uidvalidity" not in meta or "finished_at" in meta:
+            return False, None
+        return True, json.loads(meta["uidvalidity"])
+
+    def start(self, uidvalidity, messages):
+        """Replace any old run with a new snapshot of [(uid, sender, subject, message_id), ...]."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM messages")
+            self._db.execute("DELETE FROM batches")
+            self._db.executemany(
+                "INSERT INTO messages (uid, sender, subject, message_id, state, updated_at)"
+                " VALUES (?, ?, ?, ?, 'pending', ?)",
+                [(int(uid), sender, subject, message_id, now) for uid, sender, subject, message_id in messages],
+            )
+            self._db.execute("DELETE FROM meta")
+            self._db.execute("INSERT INTO meta VALUES ('uidvalidity', ?)", (json.dumps(uidvalidity),))
+            self._db.execute("INSERT INTO meta VALUES ('snapshot_at', ?)", (str(now),))
+
+    def finish(self):
+        """Mark the run complete, so the next backfill takes a fresh snapshot."""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('finished_at', ?)", (str(time.time()),))
+
+    def recover(self):
+        """After a crash, a reply caught mid-send may or may not have gone out: don't risk sending it twice."""
+        with self._lock, self._db:
+            return self._db.execute(
+                "UPDATE messages SET state = 'failed', error = 'interrupted while sending; check Sent mail',"
+                " updated_at = ? WHERE state = 'sending'", (time.time(),)
+            ).rowcount
+
+    def pending(self, limit):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid FROM messages WHERE state = 'pending' ORDER BY uid LIMIT ?", (limit,)
+            ).fetchall()
+        return [uid for (uid,) in rows]
+
+    def message(self, uid):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sender, subject, message_id, state FROM messages WHERE uid = ?", (int(uid),)
+            ).fetchone()
+        return None if row is None else dict(zip(("sender", "subject", "message_id", "state"), row))
+
+    def submitted(self, batch_id, uids):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO batches VALUES (?, ?)", (batch_id, now))
+            self._db.executemany(
+                "UPDATE messages SET state = 'submitted', batch_id = ?, updated_at = ? WHERE uid = ?",
+                [(batch_id, now, int(uid)) for uid in uids],
+            )
+
+    def open_batches(self):
+        with self._lock:
+            return [b for (b,) in self._db.execute("SELECT batch_id FROM batches ORDER BY submitted_at")]
+
+    def mark(self, uid, state, error=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE messages SET state = ?, error = ?, updated_at = ? WHERE uid = ?",
+                (state, error, time.time(), int(uid)),
+            )
+
+    def retry(self, uid, error, max_attempts):
+        """Count a failed completion; the message goes back to pending until max_attempts."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE messages SET attempts = attempts + 1, error = ?, updated_at = ?,"
+                " state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END"
+                " WHERE uid = ? AND state = 'submitted'",
+                (str(error), time.time(), max_attempts, int(uid)),
+            )
+
+    def close_batch(self, batch_id, error, max_attempts):
+        """Forget a finished batch; each message it didn't answer uses up an attempt (see retry)."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE messages SET attempts = attempts + 1, error = ?, updated_at = ?,"
+                " state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END"
+                " WHERE batch_id = ? AND state = 'submitted'",
+                (str(error), time.time(), max_attempts, batch_id),
+            )
+            self._db.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM messages GROUP BY state").fetchall())
+
+
+class Backfill:
+    """
+    Snapshot, batch, send, checkpoint. The callbacks keep it independent of
+    any one bot script:
+
+    - wanted(headers) -> (bool, reply-to address) picks the target mail;
+    - build_request(text, subject) -> chat completion request body;
+    - send_reply(to_addr, subject, message_id, text) sends one reply and
+      returns only once it has gone out.
+    """
+
+    def __init__(self, pool, checkpoint, batches, wanted, build_request, send_reply, ledger=None,
+                 batch_size=200, max_in_flight=4, poll_interval=5.0, max_attempts=3):
+        self.pool = pool
+        self.checkpoint = checkpoint
+        self.batches = batches
+        self.wanted = wanted
+        self.build_request = build_request
+        self.send_reply = send_reply
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._uidvalidity = None
+
+    def _snapshot(self):
+        """Resume the saved snapshot if it still matches the mailbox, otherwise take a new one."""
+        with self.pool.session() as mail:
+            self._uidvalidity = getattr(mail, "uidvalidity", None)
+            resumable, saved = self.checkpoint.unfinished()
+            if resumable and saved == self._uidvalidity:
+                print(f"📌 Resuming backfill: {self.checkpoint.counts()}")
+                return
+            if resumable:
+                print("⚠️ UIDVALIDITY changed since the last backfill; its UIDs are stale, starting over")
+            _, data = mail.uid("SEARCH", None, "UNSEEN")
+            uids = data[0].split()
+            if self.ledger is not None:
+                uids = self.ledger.filter_new(self._uidvalidity, uids)
+            targets = []
+            for first in range(0, len(uids), 500):
+                for h in fetch_headers(mail, uids[first:first + 500]):
+                    wanted, address = self.wanted(h)
+                    if wanted:
+                        targets.append((h["id"], address, h["subject"], h["message_id"]))
+        self.checkpoint.start(self._uidvalidity, targets)
+        print(f"📸 Snapshotted {len(targets)} backlog message(s) out of {len(uids)} unread")
+
+    def _submit(self, uids):
+        """Fetch these messages' text and submit one batch of completion requests."""
+        requests = []
+        with self.pool.session() as mail:
+            headers = fetch_headers(mail, uids)
+            for uid, raw in iter_text_bodies(mail, headers):
+                row = self.checkpoint.message(uid)
+                text = clean_reply_text(extract_body(parse_message(raw)))
+                requests.append({"custom_id": uid.decode(), "body": self.build_request(text, row["subject"])})
+        missing = set(uids) - {int(r["custom_id"]) for r in requests}
+        for uid in missing:
+            self.checkpoint.mark(uid, "skipped", "no longer in the mailbox")
+        if not requests:
+            return
+        batch_id = self.batches.submit(requests)
+        self.checkpoint.submitted(batch_id, [int(r["custom_id"]) for r in requests])
+        print(f"📦 Submitted batch {batch_id} ({len(requests)} message(s))")
+
+    def _deliver(self, uid, result):
+        row = self.checkpoint.message(uid)
+        if row is None or row["state"] != "submitted":
+            return  # Already handled (e.g. a duplicate result)
+        if isinstance(result, BaseException):
+            self.checkpoint.retry(uid, result, self.max_attempts)
+            print(f"⚠️ UID {uid}: completion failed ({result})")
+            return
+        self.checkpoint.mark(uid, "sending")
+        try:
+            self.send_reply(row["sender"], row["subject"], row["message_id"], result)
+        except Exception as e:
+            self.checkpoint.mark(uid, "failed", f"send failed: {e}")
+            print(f"⚠️ Could not send email to {row['sender']}: {e}")
+            return
+        self.checkpoint.mark(uid, "replied")
+        print(f"📨 Replied to {row['sender']}!")
+        try:
+            mark_answered(self.pool, [uid], self.ledger)
+        except Exception as e:
+            print(f"⚠️ Replied to {row['sender']} but could not mark UID {uid} read: {e}")
+
+    def _poll(self, batch_id):
+        error = "no result in its batch"
+        try:
+            state, results = self.batches.collect(batch_id)
+        except BatchFailed as e:
+            print(f"⚠️ {e}")
+            state, results, error = "done", {}, e
+        except Exception as e:
+            print(f"⚠️ Could not poll batch {batch_id} ({e}); trying again")
+            return "running"
+        for custom_id, result in results.items():
+            self._deliver(int(custom_id), result)
+        if state != "running":
+            if state == "lost":
+                print(f"🔁 Batch {batch_id} is gone; resubmitting its unanswered messages")
+                error = "batch lost"
+            self.checkpoint.close_batch(batch_id, error, self.max_attempts)
+        return state
+
+    def run(self):
+        """Drain the backlog; returns the final per-state counts."""
+        self._snapshot()
+        interrupted = self.checkpoint.recover()
+        if interrupted:
+            print(f"⚠️ {interrupted} reply(ies) were interrupted mid-send last time; not resending them")
+        while True:
+            in_flight = self.checkpoint.open_batches()
+            while len(in_flight) < self.max_in_flight:
+                uids = self.checkpoint.pending(self.batch_size)
+                if not uids:
+                    break
+                self._submit(uids)
+                in_flight = self.checkpoint.open_batches()
+            if not in_flight:
+                break
+            states = [self._poll(batch_id) for batch_id in in_flight]
+            if "running" in states:
+                time.sleep(self.poll_interval)
+            print(f"📊 Backfill progress: {self.checkpoint.counts()}")
+        self.checkpoint.finish()
+        counts = self.checkpoint.counts()
+        print(f"🏁 Backfill finished: {counts}")
+        return counts
@@ -0,0 +1,232 @@
+"""
+Sir Peepius Message Claims
+Lets several bot instances (e.g. Cloud Function instances) work the same
+inbox without answering a message twice: each one atomically claims a
+message before downloading its body, and skips the ones it lost. Each
+call claims at most a random batch of the candidates, so instances woken
+by the same backlog split it between them instead of the first one
+taking it all; the rest is picked up on a later pass.
+"""
+
+import os
+import random
+import re
+import socket
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from imap_fetch import compress_uid_set
+
+CLAIM_KEYWORD = "$PeepiusClaimed"
+DEFAULT_LEASE_FILE = os.path.join(tempfile.gettempdir(), "sir_peepius_leases.db")
+
+_FETCH_RE = re.compile(rb"UID (\d+)|MODSEQ \((\d+)\)|FLAGS \(([^)]*)\)")
+
+
+def _instance_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _expand_uid_set(data):
+    """Inverse of compress_uid_set: b"1:3,7" -> {1, 2, 3, 7}."""
+    uids = set()
+    for part in data.decode().split(","):
+        if ":" in part:
+            low, high = sorted(int(n) for n in part.split(":"))
+            uids.update(range(low, high + 1))
+        elif part.strip():
+            uids.add(int(part))
+    return uids
+
+
+def _pick_batch(fresh, stale, batch):
+    """A random subset of at most batch candidates (0 = all): (fresh, stale, number left over)."""
+    candidates = [(uid, False) for uid in fresh] + [(uid, True) for uid in stale]
+    if not batch or len(candidates) <= batch:
+        return fresh, stale, 0
+    picked = random.sample(candidates, batch)
+    return ([uid for uid, old in picked if not old], [uid for uid, old in picked if old],
+            len(candidates) - batch)
+
+
+class ImapKeywordClaims:
+    """
+    Claims messages with a timestamped IMAP keyword ($PeepiusClaimed_<unix
+    time>), set for the whole batch by one conditional STORE (CONDSTORE
+    UNCHANGEDSINCE the highest MODSEQ just read). MODSEQs only ever grow, so
+    any message changed since that read, e.g. claimed by another instance,
+    comes back in [MODIFIED ...] and is lost. A claim older than ttl (its
+    owner crashed or never managed to reply) is stale and can be taken over.
+    At most batch messages (0 = no limit) are claimed per call.
+    """
+
+    def __init__(self, keyword=CLAIM_KEYWORD, ttl=600, batch=0):
+        self.keyword = keyword
+        self.ttl = ttl
+        self.batch = batch
+        self.won = 0
+        self.lost = 0
+        self.deferred = 0
+        self.taken_over = 0
+
+    def _flags_and_modseqs(self, conn, uids):
+        typ, data = conn.uid("FETCH", compress_uid_set(uids), "(UID FLAGS MODSEQ)")
+        if typ != "OK":
+            raise RuntimeError(f"FETCH MODSEQ failed: {data}")
+        found = {}
+        for item in data:
+            if not isinstance(item, bytes):
+                continue
+            uid, modseq, flags = None, None, b""
+            for u, m, f in _FETCH_RE.findall(item):
+                uid = u or uid
+                modseq = m or modseq
+                flags = f or flags
+            if uid and modseq:
+                found[uid] = (int(modseq), flags.split())
+        return found
+
+    def _is_claim(self, flag):
+        flag = flag.decode()
+        return flag == self.keyword or flag.startswith(self.keyword + "_")
+
+    def _claimed_at(self, flags):
+        """When the newest claim keyword was set (0 for an untimed one), or None if unclaimed."""
+        stamps = [flag.decode()[len(self.keyword) + 1:] for flag in flags if self._is_claim(flag)]
+        if not stamps:
+            return None
+        return max(int(stamp) if stamp.isdigit() else 0 for stamp in stamps)
+
+    def _store(self, conn, uids, modseq, action, flags):
+        """Conditional STORE on a UID set; returns the UIDs it was applied to."""
+        conn.response("MODIFIED")  # Clear any stale response code
+        typ, _ = conn.uid("STORE", compress_uid_set(uids), f"(UNCHANGEDSINCE {modseq}) {action}", flags)
+        _, modified = conn.response("MODIFIED")
+        if typ != "OK":
+            return []
+        failed = set()
+        for item in modified:
+            if item:
+                failed |= _expand_uid_set(item)
+        return [uid for uid in uids if int(uid) not in failed]
+
+    def claim(self, conn, uids):
+        """Return the subset of uids this instance now owns."""
+        if not uids:
+            return []
+        state = self._flags_and_modseqs(conn, uids)
+        now = int(time.time())
+        keyword = f"{self.keyword}_{now}"
+        fresh, stale = [], []
+        for uid in uids:
+            if uid not in state:
+                continue
+            claimed_at = self._claimed_at(state[uid][1])
+            if claimed_at is None:
+                fresh.append(uid)
+            elif claimed_at < now - self.ttl:
+                stale.append(uid)
+        fresh, stale, deferred = _pick_batch(fresh, stale, self.batch)
+
+        won = []
+        if fresh:
+            highest = max(state[uid][0] for uid in fresh)
+            won += self._store(conn, fresh, highest, "+FLAGS.SILENT", f"({keyword})")
+        for uid in stale:
+            # Swap the old claim for ours in one conditional STORE, keeping every other flag
+            modseq, flags = state[uid]
+            keep = [flag.decode() for flag in flags if not self._is_claim(flag) and flag.lower() != b"\\recent"]
+            if self._store(conn, [uid], modseq, "FLAGS.SILENT", f"({' '.join(keep + [keyword])})"):
+                won.append(uid)
+                self.taken_over += 1
+                print(f"🤝 Took over a stale claim on UID {uid.decode()}")
+        self.won += len(won)
+        self.deferred += deferred
+        self.lost += len(uids) - len(won) - deferred
+        return won
+
+    def stats(self):
+        return {"backend": "imap", "won": self.won, "lost": self.lost, "deferred": self.deferred,
+                "taken_over": self.taken_over}
+
+
+class LeaseTableClaims:
+    """
+    Local stand-in backed by a SQLite lease table: a claim is a row that only
+    one owner can insert (or take over once the previous lease expired).
+    At most batch messages (0 = no limit) are claimed per call.
+    """
+
+    def __init__(self, path=DEFAULT_LEASE_FILE, ttl=600, owner=None, batch=0):
+        self.path = path
+        self.ttl = ttl
+        self.owner = owner or _instance_id()
+        self.batch = batch
+        self.won = 0
+        self.lost = 0
+        self.deferred = 0
+        db = sqlite3.connect(path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " message TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        db.commit()
+        db.close()
+
+    def claim(self, conn, uids):
+        """Return the subset of uids this instance now owns."""
+        if not uids:
+            return []
+        uidvalidity = getattr(conn, "uidvalidity", None)
+        now = time.time()
+        won = []
+        lost = 0
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            for uid in random.sample(list(uids), len(uids)):
+                if self.batch and len(won) >= self.batch:
+                    break
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO leases VALUES (?, ?, ?)",
+                    (f"{uidvalidity}:{int(uid)}", self.owner, now + self.ttl),
+                )
+                if cursor.rowcount == 1:
+                    won.append(uid)
+                else:
+                    lost += 1
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        self.won += len(won)
+        self.lost += lost
+        self.deferred += len(uids) - len(won) - lost
+        return won
+
+    def stats(self):
+        return {"backend": "sqlite", "owner": self.owner, "won": self.won, "lost": self.lost,
+                "deferred": self.deferred}
+
+
+def make_claims(backend):
+    """
+    Build the claim backend named by CLAIM_BACKEND ("imap", "sqlite" or
+    "none"); claims go stale after CLAIM_TTL seconds, and each call claims
+    at most CLAIM_BATCH messages (0 = no limit).
+    """
+    backend = (backend or "none").lower()
+    ttl = float(os.getenv("CLAIM_TTL", "600"))
+    batch = int(os.getenv("CLAIM_BATCH", "10"))
+    if backend == "imap":
+        return ImapKeywordClaims(ttl=ttl, batch=batch)
+    if backend == "sqlite":
+        return LeaseTableClaims(os.getenv("CLAIM_LEASE_FILE", DEFAULT_LEASE_FILE), ttl=ttl, batch=batch)
+    return None
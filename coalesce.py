@@ -0,0 +1,96 @@
+"""
+Sir Peepius Notification Coalescer
+Gmail often fires several Pub/Sub notifications within a second. This merges
+everything that arrives within a short window (keeping the highest
+historyId) into one mailbox sync, and lets a sync that is already running
+absorb notifications that land meanwhile instead of starting another one.
+"""
+
+import threading
+import time
+import traceback
+
+
+class NotificationCoalescer:
+    """Runs sync(history_id) at most once per window, never two at a time."""
+
+    def __init__(self, sync, window=0.5):
+        self.sync = sync
+        self.window = window
+        self._cond = threading.Condition()
+        self._running = False
+        self._history_id = None
+        self._requested = 0   # Generation of the newest notification
+        self._completed = 0   # Newest generation covered by a finished sync
+        self._last_result = None
+        self.received = 0
+        self.syncs = 0
+        self.sync_seconds = 0.0
+
+    def notify(self, history_id=None, wait=False):
+        """
+        Record a notification. With wait=False this returns immediately and a
+        background thread runs the sync. With wait=True (e.g. inside a Cloud
+        Function) it blocks until a sync that covers this notification has
+        finished, and returns that sync's result.
+        """
+        with self._cond:
+            self.received += 1
+            if history_id is not None:
+                history_id = int(history_id)
+                self._history_id = max(history_id, self._history_id or 0)
+            self._requested += 1
+            generation = self._requested
+            leader = not self._running
+            self._running = True
+
+        if leader:
+            if not wait:
+                threading.Thread(target=self._lead, daemon=True).start()
+                return None
+            self._lead()
+
+        if wait:
+            with self._cond:
+                while self._completed < generation:
+                    self._cond.wait()
+                return self._last_result
+        return None
+
+    def _lead(self):
+        """Sleep out the window, then sync until no notifications are left uncovered."""
+        time.sleep(self.window)
+        while True:
+            with self._cond:
+                if self._completed == self._requested:
+                    # Checked and cleared under the lock, so no notification slips through
+                    self._running = False
+                    self._cond.notify_all()
+                    return
+                history_id, self._history_id = self._history_id, None
+                generation = self._requested
+
+            start = time.monotonic()
+            try:
+                result = self.sync(history_id)
+            except Exception as e:
+                traceback.print_exc()
+                result = (f"Error: {e}", 500)
+
+            with self._cond:
+                self.syncs += 1
+                self.sync_seconds += time.monotonic() - start
+                self._completed = generation
+                self._last_result = result
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "received": self.received,
+                "syncs": self.syncs,
+                "coalesced": self._completed - self.syncs,
+                "pending": self._requested - self._completed,
+                "running": self._running,
+                "avg_sync_seconds": round(self.sync_seconds / self.syncs, 3) if self.syncs else None,
+            }
@@ -0,0 +1,218 @@
+"""
+Sir Peepius Completion Executor
+Runs OpenAI completions under a hard deadline. If a request is still
+running past the recent p95 latency, a duplicate (hedge) request is sent
+and whichever answers first wins. 429s and 5xx errors are retried with
+exponential backoff and full jitter (honouring Retry-After), always within
+the deadline.
+
+call(timeout) must make one request that gives up after `timeout` seconds,
+e.g. client.with_options(timeout=timeout, max_retries=0).chat.completions.create(...).
+A losing hedge can't be interrupted mid-request, so it's abandoned; its own
+timeout keeps it from outliving the deadline.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class DeadlineExceeded(TimeoutError):
+    """No answer within the completion deadline."""
+
+
+def _status(error):
+    """HTTP status of an API error (openai, httpx or urllib style), or None."""
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """Rate limits, server errors and dropped connections/timeouts are worth another try."""
+    status = _status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (TimeoutError, ConnectionError, OSError)) or \
+        type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectTimeout", "ReadTimeout")
+
+
+class CompletionExecutor:
+    """run(call) → call's result, hedged and retried, or DeadlineExceeded."""
+
+    def __init__(self, deadline=45.0, hedge=True, max_retries=3, base_delay=0.5, max_delay=8.0,
+                 min_samples=20, window=200, max_workers=16):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="completion")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)  # Successful single-request latencies
+        self._totals = deque(maxlen=window)     # End-to-end latencies seen by callers
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.deadline_misses = 0
+
+    def _hedge_after(self):
+        """Current p95 of single-request latency, once there are enough samples."""
+        with self._lock:
+            if not self.hedge or len(self._latencies) < self.min_samples:
+                return None
+            samples = sorted(self._latencies)
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def _timed(self, call, timeout):
+        start = time.monotonic()
+        result = call(timeout)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    def _attempt(self, call, give_up_at):
+        """One (possibly hedged) attempt. Raises the first error if every request failed."""
+        remaining = give_up_at - time.monotonic()
+        futures = {self._pool.submit(self._timed, call, remaining): "primary"}
+        hedge_after = self._hedge_after()
+        error = None
+        while futures:
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"no completion within {self.deadline}s")
+            timeout = remaining
+            if hedge_after is not None and len(futures) == 1 and "hedge" not in futures.values():
+                timeout = min(remaining, hedge_after)
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge_after is not None and "hedge" not in futures.values() and error is None:
+                    # Still running past p95: race a duplicate request against it
+                    futures[self._pool.submit(self._timed, call, give_up_at - time.monotonic())] = "hedge"
+                    with self._lock:
+                        self.hedges += 1
+                    hedge_after = None
+                continue
+            for future in done:
+                role = futures.pop(future)
+                if future.exception() is None:
+                    if role == "hedge":
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def run(self, call):
+        start = time.monotonic()
+        give_up_at = start + self.deadline
+        with self._lock:
+            self.calls += 1
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(call, give_up_at)
+                with self._lock:
+                    self._totals.append(time.monotonic() - start)
+                return result
+            except DeadlineExceeded:
+                with self._lock:
+                    self.deadline_misses += 1
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                delay = max(delay, _retry_after(e) or 0)
+                if time.monotonic() + delay >= give_up_at:
+                    with self._lock:
+                        self.deadline_misses += 1
+                    raise DeadlineExceeded(f"no completion within {self.deadline}s (last error: {e})") from e
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                print(f"🔁 Completion failed ({e}); retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._totals)
+            pct = lambda p: round(samples[int(p * (len(samples) - 1))], 3) if samples else None
+            return {
+                "calls": self.calls,
+                "p50_seconds": pct(0.50),
+                "p95_seconds": pct(0.95),
+                "p99_seconds": pct(0.99),
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "retries": self.retries,
+                "deadline_misses": self.deadline_misses,
+            }
+
+
+if __name__ == "__main__":
+    # Benchmark against a local fake completion server with a heavy latency tail
+    import json
+    import urllib.error
+    import urllib.request
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class FakeCompletions(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            roll = random.random()
+            if roll < 0.03:
+                self.send_response(429)
+                self.send_header("Retry-After", "0.05")
+                self.end_headers()
+                return
+            if roll < 0.05:
+                self.send_response(503)
+                self.end_headers()
+                return
+            # Mostly ~80 ms, with 8% of requests stalling for 1-2 s
+            time.sleep(random.uniform(1.0, 2.0) if roll > 0.92 else random.lognormvariate(-2.5, 0.3))
+            body = json.dumps({"choices": [{"message": {"content": "Ahoy!"}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCompletions)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    def call(timeout):
+        request = urllib.request.Request(url, data=b'{"model": "fake"}', method="POST")
+        with urllib.request.urlopen(request, timeout=max(timeout, 0.01)) as response:
+            return json.load(response)
+
+    for hedge in (False, True):
+        random.seed(42)
+        executor = CompletionExecutor(deadline=10, hedge=hedge, base_delay=0.05, max_workers=32)
+        for _ in range(300):
+            executor.run(call)
+        s = executor.stats()
+        print(f"{'hedged  ' if hedge else 'unhedged'} p50 {s['p50_seconds']}s  p95 {s['p95_seconds']}s  "
+              f"p99 {s['p99_seconds']}s  hedges {s['hedges']} (won {s['hedge_wins']})  retries {s['retries']}")
+    server.shutdown()
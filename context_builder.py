@@ -0,0 +1,156 @@
+"""
+Sir Peepius Context Builder
+Fills a fixed token budget with the most recent turns of a correspondence,
+and folds everything older into a rolling per-sender summary. The summary
+is updated incrementally: each turn is summarized once, when it first falls
+out of the window, so prompt size stays bounded however long the
+correspondence runs.
+"""
+
+import threading
+
+from reply_parser import estimate_tokens
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken not installed, or no encoding files offline
+    _encoding = None
+
+MESSAGE_OVERHEAD = 4  # Role and separators per chat message
+
+
+def count_tokens(text):
+    """Exact token count with tiktoken when available, otherwise a ~4 chars/token estimate."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def _trim_to_tokens(text, max_tokens):
+    """Cut text down to about max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[: max_tokens * 4]
+
+
+class ContextBuilder:
+    """
+    build(sender, system_prompt, message) returns the history messages to put
+    between the system prompt and the new message: the summary (if any) and
+    as many recent turns as fit in budget_tokens.
+
+    summarize(previous_summary, turns, max_tokens) returns the new summary;
+    turns is a list of {"role", "content"} dicts, oldest first.
+
+    With recall(sender, message, exclude_ids), up to recall_tokens of older
+    turns relevant to the message (e.g. from a MemoryIndex) are added too.
+    """
+
+    def __init__(self, store, summarize, budget_tokens=3000, summary_tokens=400,
+                 max_window_turns=50, fold_batch=20, recall=None, recall_tokens=500):
+        self.store = store
+        self.summarize = summarize
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.max_window_turns = max_window_turns
+        self.fold_batch = fold_batch
+        self.recall = recall
+        self.recall_tokens = recall_tokens if recall else 0
+        self._fold_lock = threading.Lock()
+        self.builds = 0
+        self.folds = 0
+        self.folded_turns = 0
+        self.recalled_turns = 0
+        self.last_prompt_tokens = 0
+
+    def _window(self, sender, budget):
+        """Newest turns that fit in budget, oldest first, plus the ids kept (oldest last)."""
+        window = []
+        ids = []
+        for turn_id, role, content in self.store.recent_turns(sender, self.max_window_turns):
+            cost = count_tokens(content) + MESSAGE_OVERHEAD
+            if cost > budget:
+                break
+            budget -= cost
+            window.append({"role": role, "content": content})
+            ids.append(turn_id)
+        window.reverse()
+        return window, ids
+
+    def _fold(self, sender, before_id):
+        """Fold every not-yet-summarized turn older than before_id into the sender's summary."""
+        with self._fold_lock:
+            summary, through_id = self.store.summary(sender)
+            while True:
+                rows = self.store.turns_between(sender, through_id, before_id, self.fold_batch)
+                if not rows:
+                    return summary
+                turns = [{"role": role, "content": content} for _, role, content in rows]
+                try:
+                    summary = _trim_to_tokens(self.summarize(summary, turns, self.summary_tokens), self.summary_tokens)
+                except Exception as e:
+                    # Leave these turns unfolded; the next build tries again
+                    print(f"⚠️ Couldn't update the conversation summary: {e}")
+                    return summary
+                through_id = rows[-1][0]
+                self.store.save_summary(sender, summary, through_id)
+                self.folds += 1
+                self.folded_turns += len(rows)
+
+    def _recall(self, sender, message, window_ids):
+        """Relevant older turns (not already in the window) that fit in recall_tokens, as one block of text."""
+        if not self.recall:
+            return ""
+        try:
+            hits = self.recall(sender, message, set(window_ids))
+        except Exception as e:
+            print(f"⚠️ Memory recall failed: {e}")
+            return ""
+        lines = []
+        budget = self.recall_tokens
+        for _, role, content in hits:
+            line = f"{role}: {content}"
+            cost = count_tokens(line)
+            if cost > budget:
+                break
+            budget -= cost
+            lines.append(line)
+        self.recalled_turns += len(lines)
+        return "\n\n".join(lines)
+
+    def build(self, sender, system_prompt, message):
+        fixed = count_tokens(system_prompt) + count_tokens(message) + 2 * MESSAGE_OVERHEAD
+        budget = max(self.budget_tokens - fixed - self.summary_tokens - self.recall_tokens - 2 * MESSAGE_OVERHEAD, 0)
+        window, window_ids = self._window(sender, budget)
+
+        # Everything older than the window belongs in the summary
+        if window_ids:
+            oldest_id = window_ids[-1]
+        else:
+            latest = self.store.recent_turns(sender, 1)
+            oldest_id = latest[0][0] + 1 if latest else 0
+        summary = self._fold(sender, oldest_id)
+
+        context = []
+        if summary:
+            context.append({"role": "system", "content": f"Summary of earlier correspondence with this sender:\n{summary}"})
+        recalled = self._recall(sender, message, window_ids)
+        if recalled:
+            context.append({"role": "system", "content": f"Relevant earlier exchanges:\n{recalled}"})
+        context += window
+        self.builds += 1
+        self.last_prompt_tokens = fixed + sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in context)
+        return context
+
+    def stats(self):
+        return {
+            "budget_tokens": self.budget_tokens,
+            "builds": self.builds,
+            "folds": self.folds,
+            "folded_turns": self.folded_turns,
+            "recalled_turns": self.recalled_turns,
+            "last_prompt_tokens": self.last_prompt_tokens,
+        }
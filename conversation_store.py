@@ -0,0 +1,171 @@
+"""
+Sir Peepius Conversation Store
+Append-only conversation log in SQLite (WAL mode), keyed by sender and
+thread. Each reply appends its turns in one small transaction instead of
+rewriting a JSON file, the last k turns of a thread come straight off an
+index, and several processes can share the file safely.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_CONVERSATION_FILE = "fox_memory.db"
+
+_REPLY_PREFIX_RE = re.compile(r"^\s*((re|fwd?|aw|sv)\s*(\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+
+
+def thread_key(subject):
+    """Group "Re: Re: Fwd: Hello" with "Hello"."""
+    return _REPLY_PREFIX_RE.sub("", str(subject or "")).strip().lower()
+
+
+class ConversationStore:
+    """Turns stored as (sender, thread, role, content) rows, oldest first by id."""
+
+    def __init__(self, path=DEFAULT_CONVERSATION_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " sender TEXT NOT NULL,"
+            " thread TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS turns_by_thread ON turns (sender, thread, id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS turns_by_sender ON turns (sender, id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " sender TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " through_id INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self.appended = 0
+
+    def append(self, sender, thread, turns):
+        """Atomically add [(role, content), ...] to a thread. Returns the new turn ids."""
+        now = time.time()
+        rows = [(sender.lower(), thread, role, content, now) for role, content in turns]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [
+                    self._db.execute(
+                        "INSERT INTO turns (sender, thread, role, content, created_at) VALUES (?, ?, ?, ?, ?)", row
+                    ).lastrowid
+                    for row in rows
+                ]
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self.appended += len(rows)
+        return ids
+
+    def history(self, sender, thread=None, limit=10):
+        """
+        The last `limit` turns as chat messages, oldest first: of one thread,
+        or of everything with this sender when thread is None.
+        """
+        with self._lock:
+            if thread is None:
+                rows = self._db.execute(
+                    "SELECT role, content FROM turns WHERE sender = ? ORDER BY id DESC LIMIT ?",
+                    (sender.lower(), limit),
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT role, content FROM turns WHERE sender = ? AND thread = ?"
+                    " ORDER BY id DESC LIMIT ?",
+                    (sender.lower(), thread, limit),
+                ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def recent_turns(self, sender, limit):
+        """The sender's last `limit` turns as (id, role, content), newest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, role, content FROM turns WHERE sender = ? ORDER BY id DESC LIMIT ?",
+                (sender.lower(), limit),
+            ).fetchall()
+
+    def turns_between(self, sender, after_id, before_id, limit):
+        """Up to `limit` turns with after_id < id < before_id as (id, role, content), oldest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, role, content FROM turns WHERE sender = ? AND id > ? AND id < ?"
+                " ORDER BY id LIMIT ?",
+                (sender.lower(), after_id, before_id, limit),
+            ).fetchall()
+
+    def turns_after(self, after_id, limit):
+        """Up to `limit` turns of any sender with id > after_id as (id, sender, content), oldest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, sender, content FROM turns WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+            ).fetchall()
+
+    def turns_by_ids(self, ids):
+        """(id, role, content) for the given turn ids, in the order asked for."""
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, role, content FROM turns WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+            ).fetchall()
+        by_id = {row[0]: row for row in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def summary(self, sender):
+        """(summary text, id of the last turn folded into it) for a sender."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary, through_id FROM summaries WHERE sender = ?", (sender.lower(),)
+            ).fetchone()
+        return row or ("", 0)
+
+    def save_summary(self, sender, summary, through_id):
+        """Store a newer summary; a slower worker can't roll it back to an older one."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO summaries VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(sender) DO UPDATE SET summary = excluded.summary,"
+                " through_id = excluded.through_id, updated_at = excluded.updated_at"
+                " WHERE excluded.through_id > summaries.through_id",
+                (sender.lower(), summary, through_id, time.time()),
+            )
+
+    def import_json(self, json_path, sender, thread=""):
+        """One-time migration of an old fox_memory.json; the file is renamed so it isn't imported twice."""
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path) as f:
+                memory = json.load(f)
+        except ValueError:
+            memory = []  # Empty or unreadable: nothing to carry over (the file is still kept as .migrated)
+        if not isinstance(memory, list):
+            memory = []
+        turns = [(m["role"], m["content"]) for m in memory
+                 if isinstance(m, dict) and m.get("role") and m.get("content")]
+        if turns:
+            self.append(sender, thread, turns)
+        os.replace(json_path, json_path + ".migrated")
+        return len(turns)
+
+    def stats(self):
+        with self._lock:
+            total, senders, threads = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sender), COUNT(DISTINCT sender || '|' || thread) FROM turns"
+            ).fetchone()
+        return {"turns": total, "senders": senders, "threads": threads, "appended": self.appended}
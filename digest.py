@@ -0,0 +1,87 @@
+"""
+Sir Peepius Digest Batcher
+Holds parsed messages for a short window and groups them by sender (or
+thread), so a burst of five emails from one person is answered with one
+completion and one reply instead of five. Slots into a Pipeline between
+the parse and generate stages.
+"""
+
+import threading
+import time
+
+
+class DigestBatcher:
+    """
+    Pipeline stage that buffers items per key(item) and hands each group to
+    the next stage as a list, `window` seconds after the group's first item
+    (or as soon as it reaches max_items).
+    """
+
+    def __init__(self, key, window=30.0, max_items=10, name="digest"):
+        self.name = name
+        self.key = key
+        self.window = window
+        self.max_items = max_items
+        self.next = None
+        self._cond = threading.Condition()
+        self._groups = {}  # key -> (first_seen, [items])
+        self._handing = 0  # Groups taken out but not yet queued on the next stage
+        self.received = 0
+        self.digests = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+
+    def put(self, item, block=True):
+        full = None
+        with self._cond:
+            self.received += 1
+            key = self.key(item)
+            first_seen, items = self._groups.setdefault(key, (time.monotonic(), []))
+            items.append(item)
+            if len(items) >= self.max_items:
+                full = self._groups.pop(key)[1]
+                self._handing += 1
+            self._cond.notify_all()
+        if full:
+            self._hand_on(full)
+
+    def _hand_on(self, items):
+        try:
+            self.next.put(items)
+        finally:
+            with self._cond:
+                self.digests += 1
+                self._handing -= 1
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [k for k, (first_seen, _) in self._groups.items() if now - first_seen >= self.window]
+                ready = [self._groups.pop(k)[1] for k in due]
+                self._handing += len(ready)
+                if not ready:
+                    waits = [self.window - (now - first_seen) for first_seen, _ in self._groups.values()]
+                    self._cond.wait(timeout=min(waits) if waits else None)
+                    continue
+            for items in ready:
+                self._hand_on(items)
+
+    def join(self):
+        """Wait until every buffered group has been handed to the next stage."""
+        with self._cond:
+            while self._groups or self._handing:
+                self._cond.wait()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "window_seconds": self.window,
+                "waiting_groups": len(self._groups),
+                "waiting_messages": sum(len(items) for _, items in self._groups.values()),
+                "received": self.received,
+                "digests": self.digests,
+                "calls_saved": self.received - self.digests - sum(len(i) for _, i in self._groups.values()),
+            }
@@ -1,8 +1,15 @@
-import imaplib, smtplib, email, os, time, json, sys
-from email.utils import parseaddr
+import os, time, sys
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
-from openai import OpenAI
+from imap_pool import get_pool
+from smtp_sender import get_sender
+from imap_idle import run_idle_loop
+from imap_fetch import fetch_matching, mark_answered, mark_failed
+from uid_ledger import UIDLedger, DEFAULT_LEDGER_FILE
+from mime_body import parse_message, extract_body
+from reply_parser import clean_reply_text
+from sender_match import SenderMatcher
+from reply_generator import make_reply_generator
 
 # 🧭 Load secrets from .env
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
@@ -11,15 +18,11 @@ EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASS = os.getenv("EMAIL_PASS")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Configure one or more target addresses Sir Peepius should reply to.
-# You can set the environment variable TARGET_EMAILS to a comma-separated list
-# (for example, TARGET_EMAILS="a@example.com,b@example.com"). If not set,
-# the default is the single address below.
-TARGET_EMAILS_ENV = os.getenv("TARGET_EMAILS")
-if not TARGET_EMAILS_ENV:
-    print("❌ Missing TARGET_EMAILS in .env or environment.\nPlease set TARGET_EMAILS to a comma-separated list of addresses, e.g. TARGET_EMAILS=\"a@x.com,b@y.com\".")
+# Built once: exact addresses, @domain wildcards, optional TARGET_EMAILS_FILE and DENY_EMAILS
+SENDER_MATCHER = SenderMatcher.from_env()
+if not len(SENDER_MATCHER):
+    print("❌ No targets configured.\nPlease set TARGET_EMAILS to a comma-separated list of addresses (e.g. TARGET_EMAILS=\"a@x.com,b@y.com\") or point TARGET_EMAILS_FILE at a file with one per line.")
     sys.exit(1)
-TARGET_EMAILS = [e.strip() for e in TARGET_EMAILS_ENV.split(",") if e.strip()]
 
 # ⚓ Check secrets
 for name, val in {
@@ -36,68 +39,87 @@ IMAP_SERVER = "imap.gmail.com"
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 465
 
+# Shared IMAP connection, kept logged in between polls
+IMAP_POOL = get_pool(IMAP_SERVER, EMAIL_USER, EMAIL_PASS)
+
+# UIDs already ignored or answered, so unread non-target mail isn't re-fetched every poll
+UID_LEDGER = UIDLedger(os.getenv("UID_LEDGER_FILE", DEFAULT_LEDGER_FILE))
+
+# Warm SMTP session; replies are queued and sent over it in the background
+SMTP_SENDER = get_sender(SMTP_SERVER, SMTP_PORT, EMAIL_USER, EMAIL_PASS)
+
+def should_reply_to_sender(sender):
+    """Check if we should reply to this sender based on TARGET_EMAILS (and DENY_EMAILS)."""
+    return SENDER_MATCHER.check(sender)
+
+def is_target(headers):
+    should_reply, _ = should_reply_to_sender(headers["from"])
+    if not should_reply:
+        print(f"🦢 Ignorin' {headers['from']} — not one of the targets.")
+    return should_reply
+
 def fetch_unread():
-    mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-    mail.login(EMAIL_USER, EMAIL_PASS)
-    mail.select("inbox")
-    _, data = mail.search(None, "UNSEEN")
+    with IMAP_POOL.session() as mail:
+        _, data = mail.uid("SEARCH", None, "UNSEEN")
+        # Headers first, so non-target mail never has its body downloaded
+        fetched = list(fetch_matching(mail, data[0].split(), is_target, ledger=UID_LEDGER))
     emails = []
-    for num in data[0].split():
-        _, msg_data = mail.fetch(num, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
+    for headers, raw in fetched:
+        msg = parse_message(raw)
         subject = msg["subject"]
         sender = msg["from"]
-        body = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    body += part.get_payload(decode=True).decode(errors="ignore")
-        else:
-            body = msg.get_payload(decode=True).decode(errors="ignore")
-        emails.append((sender, subject, body))
-    mail.logout()
+        body = clean_reply_text(extract_body(msg))
+        emails.append((headers["id"], sender, subject, body))
     return emails
 
-def generate_reply(text):
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    messages = [
-        {"role": "system", "content": "You are sir peepius aurelius of chickenopolis. You are a very noble chicken, and you are very proud."},
-        {"role": "user", "content": text}
-    ]
-    response = client.chat.completions.create(model="gpt-5", messages=messages)
-    return response.choices[0].message.content.strip()
+SYSTEM_PROMPT = "You are sir peepius aurelius of chickenopolis. You are a very noble chicken, and you are very proud."
+# Reply cache, fast/strong model routing, completion deadlines and OpenAI rate limits
+REPLIES = make_reply_generator(OPENAI_API_KEY, SYSTEM_PROMPT, strong_default="gpt-5")
+
+def generate_reply(text, subject=""):
+    return REPLIES.generate(text, subject)
 
-def send_email(to_addr, subject, body):
+def send_email(to_addr, subject, body, uid):
     msg = MIMEText(body + "\n\n— Sir Peepius Aurelius of Chickenopolis 🦊⚓")
     msg["Subject"] = f"Re: {subject}"
     msg["From"] = EMAIL_USER
     msg["To"] = to_addr
-    with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-        server.login(EMAIL_USER, EMAIL_PASS)
-        server.send_message(msg)
-    print(f"📨 Replied to {to_addr}!")
+    # Sent in the background over the shared, already-authenticated session;
+    # the message is marked answered (\Seen) only once the reply is out
+    SMTP_SENDER.enqueue(msg, on_sent=lambda: mark_answered(IMAP_POOL, [uid], UID_LEDGER))
+
+def reply_to_unread():
+    mails = fetch_unread()
+    if not mails:
+        print("🌊 No new messages…")
+        return
+    try:
+        for uid, sender, subject, body in mails:
+            _, parsed_sender = should_reply_to_sender(sender)
+            print(f"📜 From {sender}: {subject}")
+            try:
+                reply = generate_reply(body, subject)
+            except Exception as e:
+                # Left unread, so the next poll tries again (up to REPLY_MAX_ATTEMPTS times)
+                print(f"⚠️ Could not draft a reply to {sender}: {e}")
+                mark_failed(IMAP_POOL, [uid], UID_LEDGER)
+                continue
+            # Reply to the actual parsed sender address (not the configured target)
+            send_email(parsed_sender, subject, reply, uid)
+    finally:
+        # All replies from this batch go out over one SMTP session
+        SMTP_SENDER.flush()
 
 def main():
-    print(f"🦊 Sir Peepius standin' by, replyin' only to {', '.join(TARGET_EMAILS)}\n")
+    print(f"🦊 Sir Peepius standin' by, replyin' only to {len(SENDER_MATCHER)} target(s)\n")
+    # MODE=idle waits for IMAP IDLE pushes instead of polling every 15 seconds
+    if os.getenv("MODE", "polling").lower() == "idle":
+        run_idle_loop(IMAP_POOL, reply_to_unread)
     while True:
-        mails = fetch_unread()
-        if not mails:
-            print("🌊 No new messages…")
-        else:
-            for sender, subject, body in mails:
-                # Parse the envelope 'From' address and check against targets.
-                parsed_sender = parseaddr(sender)[1] or sender
-                matches_target = any(
-                    (t.lower() == parsed_sender.lower()) or (t.lower() in sender.lower())
-                    for t in TARGET_EMAILS
-                )
-                if matches_target:
-                    print(f"📜 From {sender}: {subject}")
-                    reply = generate_reply(body)
-                    # Reply to the actual parsed sender address (not the configured target)
-                    send_email(parsed_sender, subject, reply)
-                else:
-                    print(f"🦢 Ignorin' {sender} — not one of the targets.")
+        try:
+            reply_to_unread()
+        except Exception as e:
+            print(f"⚠️ Error checking mail: {e}")
         time.sleep(15)
 
 if __name__ == "__main__":
@@ -1,7 +1,21 @@
-import imaplib, smtplib, email, os, time, json, sys
+import os, time, sys
+from functools import partial
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai_client import get_openai_client
+from imap_pool import get_pool
+from smtp_sender import get_sender
+from imap_idle import run_idle_loop
+from imap_fetch import fetch_matching, mark_answered, mark_failed
+from uid_ledger import UIDLedger, DEFAULT_LEDGER_FILE
+from mime_body import parse_message, extract_body
+from reply_parser import clean_reply_text
+from sender_match import SenderMatcher
+from rate_limit import get_openai_limiter
+from reply_generator import make_reply_generator
+from conversation_store import ConversationStore, DEFAULT_CONVERSATION_FILE, thread_key
+from context_builder import ContextBuilder
+import memory_index
 
 # 🧭 Load secrets safely
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -13,6 +27,7 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # 🦊 Choose yer noble correspondent
 TARGET_EMAIL = "friend@example.com"  # ← change to the one person ye reply to
+CHOSEN_ONE = SenderMatcher([TARGET_EMAIL])
 
 # ⚓ Sanity check before sailing
 missing = [k for k, v in {
@@ -32,96 +47,180 @@ else:
 IMAP_SERVER = "imap.gmail.com"
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 465
-MEMORY_FILE = "fox_memory.json"
+LEGACY_MEMORY_FILE = "fox_memory.json"
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
 
-# 📜 Load/save conversation memory
-def load_memory():
-    if os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "r") as f:
-            return json.load(f)
-    return []
+# 🔌 Shared IMAP connection, kept logged in between polls
+IMAP_POOL = get_pool(IMAP_SERVER, EMAIL_USER, EMAIL_PASS)
 
-def save_memory(memory):
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(memory[-10:], f, indent=2)
+# 📒 UIDs already ignored or answered, so unread non-target mail isn't re-fetched every poll
+UID_LEDGER = UIDLedger(os.getenv("UID_LEDGER_FILE", DEFAULT_LEDGER_FILE))
+
+# 📮 Warm SMTP session; replies are queued and sent over it in the background
+SMTP_SENDER = get_sender(SMTP_SERVER, SMTP_PORT, EMAIL_USER, EMAIL_PASS)
+
+# 📜 Conversation memory, per sender and thread, appended to SQLite instead of rewriting a JSON file
+CONVERSATIONS = ConversationStore(os.getenv("CONVERSATION_DB", DEFAULT_CONVERSATION_FILE))
+
+def summarize_turns(previous, turns, max_tokens):
+    """Fold a few more turns into the runnin' summary of a correspondence."""
+    transcript = "\n\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    return REPLIES.complete(SUMMARY_MODEL, [
+        {"role": "system", "content": "Ye keep a short running summary of an email correspondence."},
+        {"role": "user", "content": (
+            f"Current summary:\n{previous or '(none yet)'}\n\nNew exchanges:\n{transcript}\n\n"
+            f"Update the summary to cover the new exchanges. Keep names, facts, promises and open "
+            f"questions. Stay under {max_tokens} tokens."
+        )},
+    ])
+
+# 🔎 Optional semantic recall of old exchanges (needs numpy; set MEMORY_INDEX to a file prefix)
+MEMORY_INDEX = None
+if os.getenv("MEMORY_INDEX") and memory_index.AVAILABLE:
+    if os.getenv("MEMORY_EMBEDDER", "hashing").lower() == "openai":
+        embedder = memory_index.OpenAIEmbedder(get_openai_client(OPENAI_API_KEY), limiter=get_openai_limiter())
+    else:
+        embedder = memory_index.HashingEmbedder()
+    MEMORY_INDEX = memory_index.VectorIndex(os.getenv("MEMORY_INDEX"), embedder)
+elif os.getenv("MEMORY_INDEX"):
+    print("⚠️ MEMORY_INDEX is set but numpy isn't installed; sailin' without recall.")
+
+def recall_turns(sender, message_text, exclude_ids):
+    try:
+        hits = MEMORY_INDEX.search(sender, message_text, k=3, exclude_ids=exclude_ids)
+    except Exception as e:
+        print("⚠️ Couldn’t search old voyages, replyin’ without recall:", e)
+        return []
+    return CONVERSATIONS.turns_by_ids([turn_id for turn_id, _ in hits])
+
+# 🧮 Recent turns up to a token budget, older ones folded into a per-sender summary
+CONTEXT = ContextBuilder(
+    CONVERSATIONS,
+    summarize_turns,
+    budget_tokens=int(os.getenv("CONTEXT_BUDGET_TOKENS", "3000")),
+    summary_tokens=int(os.getenv("SUMMARY_TOKENS", "400")),
+    recall=recall_turns if MEMORY_INDEX else None,
+)
+
+def load_memory(sender, message_text):
+    return CONTEXT.build(sender, SYSTEM_PROMPT, message_text)
+
+def save_memory(sender, subject, body, reply):
+    ids = CONVERSATIONS.append(sender, thread_key(subject), [("user", body), ("assistant", reply)])
+    if MEMORY_INDEX is not None:
+        try:
+            MEMORY_INDEX.add(sender, list(zip(ids, [body, reply])))
+        except Exception as e:
+            # 🔎 The turns are stored; the next start embeds whatever the index is missing
+            print("⚠️ Couldn’t index this exchange for recall:", e)
+
+# 🦢 Header-phase filter
+def is_chosen_one(headers):
+    if CHOSEN_ONE.matches(headers["from"]):
+        return True
+    print(f"🦢 Ignorin’ {headers['from']} — not the chosen one.")
+    return False
 
 # 🦜 Fetch unread messages
 def fetch_unread_emails():
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL_USER, EMAIL_PASS)
-        mail.select("inbox")
-        status, messages = mail.search(None, "UNSEEN")
+        with IMAP_POOL.session() as mail:
+            status, messages = mail.uid("SEARCH", None, "UNSEEN")
+            # 🪶 Headers first, so only the chosen one's bodies get downloaded
+            fetched = list(fetch_matching(mail, messages[0].split(), is_chosen_one, ledger=UID_LEDGER))
         emails = []
-        for num in messages[0].split():
-            _, data = mail.fetch(num, "(RFC822)")
-            msg = email.message_from_bytes(data[0][1])
+        for headers, raw in fetched:
+            msg = parse_message(raw)
             subject = msg["subject"] or "(no subject)"
             sender = msg["from"] or ""
-            body = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        body += part.get_payload(decode=True).decode(errors="ignore")
-            else:
-                body = msg.get_payload(decode=True).decode(errors="ignore")
-            emails.append((sender, subject, body))
-        mail.logout()
+            body = clean_reply_text(extract_body(msg))
+            emails.append((headers["id"], sender, subject, body))
         return emails
     except Exception as e:
         print("⚠️ Error fetchin’ emails:", e)
         return []
 
-# 🤖 Summon GPT-5 for witty replies
-def generate_reply(message_text, memory):
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    conversation = [
-        {"role": "system", "content": (
-            "Ye be Sir Peepius Aurelius of Chickenopolis, a noble, clever pirate-fox "
-            "who remembers past voyages and replies to emails with grace and wit."
-        )}
-    ] + memory + [{"role": "user", "content": message_text}]
+SYSTEM_PROMPT = (
+    "Ye be Sir Peepius Aurelius of Chickenopolis, a noble, clever pirate-fox "
+    "who remembers past voyages and replies to emails with grace and wit."
+)
+
+# 🧭 Reply cache, FAST_MODEL/STRONG_MODEL (GPT-5) routing, completion deadlines and OpenAI rate limits
+REPLIES = make_reply_generator(OPENAI_API_KEY, SYSTEM_PROMPT, strong_default="gpt-5")
+
+# 🤖 Summon GPT for witty replies
+def generate_reply(message_text, memory, subject=""):
     try:
-        completion = client.chat.completions.create(model="gpt-5", messages=conversation)
-        return completion.choices[0].message.content.strip()
+        # ♻️ Same message with the same memory → same reply, no new completion
+        return REPLIES.generate(message_text, subject, history=memory)
     except Exception as e:
+        # No canned reply: the message stays unread and unanswered, so the next check retries it
         print("⚠️ Trouble summonin’ GPT:", e)
-        return "(Sir Peepius be temporarily speechless, arrr.)"
+        return None
 
 # 📬 Send email reply
-def send_email(to_addr, subject, body):
+def send_email(to_addr, subject, body, uid, on_sent=None):
     msg = MIMEText(body + "\n\n— Sir Peepius Aurelius of Chickenopolis 🦊⚓")
     msg["Subject"] = f"Re: {subject}"
     msg["From"] = EMAIL_USER
     msg["To"] = to_addr
-    try:
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.send_message(msg)
-        print(f"📨 Sent reply to {to_addr}!")
-    except Exception as e:
-        print("⚠️ Could not send email:", e)
+
+    def sent():
+        if on_sent is not None:
+            try:
+                on_sent()
+            except Exception as e:
+                # The reply is out either way; it must still be marked answered so it isn't sent twice
+                print("⚠️ Replied, but couldn’t remember the exchange:", e)
+        mark_answered(IMAP_POOL, [uid], UID_LEDGER)
+    # 📮 Sent in the background over the shared, already-authenticated session;
+    # the message is only remembered and marked read (\Seen) once the reply is out
+    SMTP_SENDER.enqueue(msg, on_sent=sent)
 
 # 🧭 Main loop
 def main():
     print(f"🦊 Sir Peepius Aurelius standin’ by, replyin’ only to {TARGET_EMAIL}\n")
-    memory = load_memory()
+    # 📦 Carry over the old fox_memory.json, once
+    migrated = CONVERSATIONS.import_json(LEGACY_MEMORY_FILE, TARGET_EMAIL)
+    if migrated:
+        print(f"📦 Moved {migrated} remembered turns from {LEGACY_MEMORY_FILE} into {CONVERSATIONS.path}")
+    # 🔎 Catch the recall index up with the store
+    if MEMORY_INDEX is not None:
+        try:
+            indexed = MEMORY_INDEX.catch_up(CONVERSATIONS)
+            if indexed:
+                print(f"🔎 Indexed {indexed} remembered turns for recall")
+        except Exception as e:
+            print("⚠️ Couldn’t catch up the recall index, will try again next start:", e)
 
-    while True:
+    def check_inbox():
         emails = fetch_unread_emails()
         if not emails:
             print("🌊 No new messages...")
-        else:
-            for sender, subject, body in emails:
-                if TARGET_EMAIL.lower() in sender.lower():
-                    print(f"📜 Message from {sender}: {subject}")
-                    reply = generate_reply(body, memory)
-                    send_email(TARGET_EMAIL, subject, reply)
-                    memory.append({"role": "user", "content": body})
-                    memory.append({"role": "assistant", "content": reply})
-                    save_memory(memory)
-                else:
-                    print(f"🦢 Ignorin’ {sender} — not the chosen one.")
+            return
+        try:
+            for uid, sender, subject, body in emails:
+                print(f"📜 Message from {sender}: {subject}")
+                _, address = CHOSEN_ONE.check(sender)
+                reply = generate_reply(body, load_memory(address, body), subject)
+                if reply is None:
+                    # 🔁 Retried next check, up to REPLY_MAX_ATTEMPTS times, then left unread
+                    mark_failed(IMAP_POOL, [uid], UID_LEDGER)
+                    continue
+                # 📜 Remembered only once sent: a failed send is retried and mustn't leave a reply they never got
+                send_email(TARGET_EMAIL, subject, reply, uid, on_sent=partial(save_memory, address, subject, body, reply))
+        finally:
+            # 📮 All replies from this batch go out over one SMTP session
+            SMTP_SENDER.flush()
+
+    # 👂 MODE=idle waits for IMAP IDLE pushes instead of checkin' every minute
+    if os.getenv("MODE", "polling").lower() == "idle":
+        run_idle_loop(IMAP_POOL, check_inbox, poll_interval=60)
+    while True:
+        try:
+            check_inbox()
+        except Exception as e:
+            print("⚠️ Trouble checkin’ the inbox:", e)
         time.sleep(60)  # check inbox every minute
 
 if __name__ == "__main__":
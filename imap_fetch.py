@@ -0,0 +1,339 @@
+"""
+Sir Peepius Batched IMAP Fetch
+Pulls just the sender, subject, Message-ID and size for a whole batch of
+messages, so non-target mail is rejected before any body is downloaded.
+Every fetch is a single UID FETCH over a compressed UID set, streamed so
+messages are handed over as soon as their response arrives.
+
+Bodies are fetched by BODYSTRUCTURE: only the first MAX_BODY_BYTES of the
+main text part is downloaded (BODY.PEEK[n]<0.N>), never the attachments.
+"""
+
+import imaplib
+import itertools
+import os
+import re
+from email.parser import BytesHeaderParser
+
+from mime_body import MAX_BODY_BYTES, encoded_size
+
+HEADER_ITEMS = "(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)])"
+BODY_ITEMS = "(UID RFC822)"
+
+_UID_RE = re.compile(rb"\bUID (\d+)")
+_SIZE_RE = re.compile(rb"\bRFC822\.SIZE (\d+)")
+_LITERAL_RE = re.compile(rb"\{(\d+)\}\r\n$")
+_FETCH_RE = re.compile(rb"^\* \d+ FETCH ")
+_HEADER_LABEL = rb"BODY\[HEADER\.FIELDS[^\]]*\]"
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{#(\d+)\}|([^\s()"]+))')
+
+_tags = itertools.count(1)
+_header_parser = BytesHeaderParser()
+
+
+def compress_uid_set(uids):
+    """Turn UIDs into the shortest IMAP set, e.g. [1, 2, 3, 5, 9, 10] -> "1:3,5,9:10"."""
+    ordered = sorted({int(u) for u in uids})
+    ranges = []
+    for uid in ordered:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def _read_response(conn):
+    """
+    Read one full response (following any literals). Returns (metadata,
+    [literals]); each literal's place in the metadata is marked {#index}.
+    """
+    line = conn.readline()
+    if not line:
+        raise imaplib.IMAP4.abort("connection closed during FETCH")
+    meta = b""
+    literals = []
+    while True:
+        match = _LITERAL_RE.search(line)
+        if not match:
+            meta += line.rstrip(b"\r\n")
+            return meta, literals
+        meta += line[:match.start()] + b"{#%d}" % len(literals)
+        literals.append(conn.read(int(match.group(1))))
+        line = conn.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during FETCH")
+
+
+def iter_uid_fetch(conn, uids, items):
+    """
+    Issue one UID FETCH for the whole set and yield (uid, metadata, literals)
+    for each message as its response comes off the wire.
+    """
+    if not uids:
+        return
+    tag = b"PEEP%d" % next(_tags)
+    conn.send(b"%s UID FETCH %s %s\r\n" % (tag, compress_uid_set(uids).encode(), items.encode()))
+
+    done = False
+    try:
+        while True:
+            meta, literals = _read_response(conn)
+            if meta.startswith(tag):
+                done = True
+                if not meta[len(tag):].lstrip().upper().startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"UID FETCH failed: {meta.decode(errors='ignore')}")
+                return
+            if not _FETCH_RE.match(meta):
+                continue  # Unrelated untagged data (EXISTS, EXPUNGE, ...)
+            uid = _UID_RE.search(meta)
+            if uid:
+                yield uid.group(1), meta, literals
+    finally:
+        if not done:
+            # The caller stopped early: drain the rest so the connection stays usable
+            try:
+                while not _read_response(conn)[0].startswith(tag):
+                    pass
+            except Exception:
+                conn.shutdown()
+
+
+def _literal(meta, literals, label):
+    """Return the literal that follows the item named by the label regex, or None."""
+    match = re.search(label + rb"(?:<\d+>)? \{#(\d+)\}", meta)
+    return literals[int(match.group(1))] if match else None
+
+
+def _parse_list(data, literals):
+    """Parse an IMAP parenthesized list (as in BODYSTRUCTURE) into nested Python lists."""
+    stack = [[]]
+    pos = 0
+    while True:
+        match = _TOKEN_RE.match(data, pos)
+        if not match:
+            return stack[0]
+        pos = match.end()
+        opening, closing, quoted, literal, atom = match.groups()
+        if opening:
+            stack.append([])
+        elif closing:
+            if len(stack) == 1:
+                return stack[0]
+            done = stack.pop()
+            stack[-1].append(done)
+            if len(stack) == 1:
+                return stack[0]
+        elif quoted is not None:
+            stack[-1].append(re.sub(rb"\\(.)", rb"\1", quoted))
+        elif literal is not None:
+            stack[-1].append(literals[int(literal)])
+        else:
+            stack[-1].append(None if atom.upper() == b"NIL" else atom)
+
+
+def _leaf_parts(structure, section=""):
+    """Yield (section, leaf) for every non-multipart part of a BODYSTRUCTURE."""
+    if structure and isinstance(structure[0], list):
+        children = itertools.takewhile(lambda child: isinstance(child, list), structure)
+        for n, child in enumerate(children, 1):
+            yield from _leaf_parts(child, f"{section}.{n}" if section else str(n))
+    else:
+        yield section or "1", structure
+
+
+def find_text_part(meta, literals):
+    """
+    Pick the part worth reading from a FETCH response's BODYSTRUCTURE: the
+    first text/plain part that isn't an attachment, else the first text/html.
+
+    Returns a dict (section, subtype, charset, encoding, size), None when the
+    message has no text part, or raises ValueError if there's no usable
+    BODYSTRUCTURE.
+    """
+    start = meta.find(b"BODYSTRUCTURE ")
+    if start < 0:
+        raise ValueError("no BODYSTRUCTURE in response")
+    parsed = _parse_list(meta[start + len(b"BODYSTRUCTURE "):], literals)
+    if not parsed or not isinstance(parsed[0], list):
+        raise ValueError("malformed BODYSTRUCTURE")
+
+    html = None
+    for section, leaf in _leaf_parts(parsed[0]):
+        if len(leaf) < 7 or not isinstance(leaf[0], bytes) or leaf[0].lower() != b"text":
+            continue
+        # text parts: type subtype params id description encoding size lines md5 disposition ...
+        disposition = leaf[9] if len(leaf) > 9 else None
+        if isinstance(disposition, list) and disposition and (disposition[0] or b"").lower() == b"attachment":
+            continue
+        params = leaf[2] if isinstance(leaf[2], list) else []
+        charset = {k.lower(): v for k, v in zip(params[::2], params[1::2]) if isinstance(k, bytes)}.get(b"charset")
+        part = {
+            "section": section,
+            "subtype": (leaf[1] or b"plain").decode(errors="ignore").lower(),
+            "charset": charset.decode(errors="ignore") if charset else "utf-8",
+            "encoding": (leaf[5] or b"7bit").decode(errors="ignore").lower(),
+            "size": int(leaf[6]) if leaf[6] and leaf[6].isdigit() else 0,
+        }
+        if part["subtype"] == "plain":
+            return part
+        if part["subtype"] == "html" and html is None:
+            html = part
+    return html
+
+
+def fetch_headers(conn, uids):
+    """Fetch From/Subject/Message-ID, RFC822.SIZE and BODYSTRUCTURE for every UID in one command."""
+    headers = []
+    for uid, meta, literals in iter_uid_fetch(conn, uids, HEADER_ITEMS):
+        literal = _literal(meta, literals, _HEADER_LABEL)
+        if literal is None:
+            continue
+        parsed = _header_parser.parsebytes(literal)
+        size = _SIZE_RE.search(meta)
+        try:
+            text_part = find_text_part(meta, literals)
+        except (ValueError, IndexError, AttributeError):
+            text_part = False  # Unknown structure: fall back to the full message
+        headers.append({
+            "id": uid,
+            "size": int(size.group(1)) if size else 0,
+            "from": parsed["from"] or "",
+            "subject": parsed["subject"] or "(no subject)",
+            "message_id": parsed["message-id"] or "",
+            "raw_header": literal,
+            "text_part": text_part,
+        })
+    return headers
+
+
+def iter_bodies(conn, uids):
+    """Fetch full (RFC822) messages in one command, yielding (uid, raw bytes) as they arrive."""
+    pending = {int(uid) for uid in uids}
+    for uid, meta, literals in iter_uid_fetch(conn, uids, BODY_ITEMS):
+        # Skip FLAGS-only updates and repeats, so each message is yielded once
+        if literals and int(uid) in pending:
+            pending.discard(int(uid))
+            yield uid, literals[0]
+
+
+def _text_message(h, part, body):
+    """Rebuild a small message from the fetched headers and the (partial) text part."""
+    mime = (f"Content-Type: text/{part['subtype']}; charset=\"{part['charset']}\"\r\n"
+            f"Content-Transfer-Encoding: {part['encoding']}\r\n\r\n").encode()
+    header = h["raw_header"].rstrip(b"\r\n")
+    return (header + b"\r\n" if header else b"") + mime + body
+
+
+def iter_text_bodies(conn, headers, max_bytes=MAX_BODY_BYTES):
+    """
+    Yield (uid, raw) for each message, downloading only the first max_bytes
+    (after transfer decoding) of its main text part. Messages are grouped by
+    part section and cap, one UID FETCH per group. Messages whose structure
+    couldn't be read are fetched whole.
+    """
+    groups = {}
+    whole = []
+    for h in headers:
+        part = h.get("text_part")
+        if part is False or "raw_header" not in h:
+            whole.append(h["id"])
+        elif part is None:
+            print(f"🪶 UID {h['id'].decode()}: no text part, fetched 0 of {h['size']} bytes")
+            yield h["id"], h["raw_header"]
+        else:
+            cap = encoded_size(part["encoding"], max_bytes)
+            groups.setdefault((part["section"], cap), []).append(h)
+
+    for (section, cap), group in groups.items():
+        by_uid = {h["id"]: h for h in group}
+        items = f"(UID BODY.PEEK[{section}]<0.{cap}>)"
+        label = rb"BODY\[" + re.escape(section.encode()) + rb"\]"
+        for uid, meta, literals in iter_uid_fetch(conn, list(by_uid), items):
+            body = _literal(meta, literals, label)
+            # Unsolicited FETCH (e.g. a FLAGS update) or a repeat: not this message's body
+            h = by_uid.pop(uid, None) if body is not None else None
+            if h is None:
+                continue
+            print(f"🪶 UID {uid.decode()}: fetched {len(body)} of {h['size']} bytes "
+                  f"({max(h['size'] - len(body), 0)} saved)")
+            yield uid, _text_message(h, h["text_part"], body)
+
+    yield from iter_bodies(conn, whole)
+
+
+def mark_answered(pool, uids, ledger=None):
+    """
+    Set \\Seen on messages that have been replied to (and record them as
+    "answered" in the ledger). Bodies are fetched with BODY.PEEK, so nothing
+    else marks them read.
+    """
+    if not uids:
+        return
+    with pool.session() as conn:
+        if ledger is not None:
+            ledger.record(getattr(conn, "uidvalidity", None), uids, "answered")
+        typ, data = conn.uid("STORE", compress_uid_set(uids), "+FLAGS.SILENT", "(\\Seen)")
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"STORE \\Seen failed: {data}")
+
+
+def mark_failed(pool, uids, ledger, max_attempts=None):
+    """
+    Count a failed reply to each message. After REPLY_MAX_ATTEMPTS failures
+    (default 3) it's recorded as "failed" in the ledger and left unread,
+    instead of being retried on every check. Returns the UIDs given up on.
+    """
+    if ledger is None or not uids:
+        return []
+    if max_attempts is None:
+        max_attempts = int(os.getenv("REPLY_MAX_ATTEMPTS", "3"))
+    with pool.session() as conn:
+        uidvalidity = getattr(conn, "uidvalidity", None)
+    given_up = ledger.record_failure(uidvalidity, uids, max_attempts)
+    for uid in given_up:
+        print(f"🚫 UID {int(uid)}: giving up after {max_attempts} failed attempts; leaving it unread")
+    return given_up
+
+
+def fetch_matching(conn, uids, wanted, ledger=None, claims=None):
+    """
+    Two-phase fetch: headers for the whole batch, then (partial) text bodies
+    only for the messages where wanted(headers) is true.
+
+    With a UIDLedger, UIDs handled on an earlier pass are skipped entirely and
+    this pass's ignored UIDs are recorded. Wanted UIDs are only recorded once
+    they've been answered (see mark_answered), so a failed reply is retried.
+    With a claims backend, wanted messages are claimed first and only the
+    ones this instance won have their bodies downloaded.
+
+    Yields (headers, raw_message) as each body arrives.
+    """
+    uidvalidity = getattr(conn, "uidvalidity", None)
+    if ledger is not None:
+        uids = ledger.filter_new(uidvalidity, uids)
+
+    keep = {}
+    ignored = []
+    skipped_bytes = 0
+    for h in fetch_headers(conn, uids):
+        if wanted(h):
+            keep[h["id"]] = h
+        else:
+            ignored.append(h["id"])
+            skipped_bytes += h["size"]
+    if skipped_bytes:
+        print(f"🪶 Skipped {skipped_bytes} bytes of non-target mail")
+    if claims is not None and keep:
+        won = set(claims.claim(conn, list(keep)))
+        lost = [uid for uid in keep if uid not in won]
+        if lost:
+            # Not recorded in the ledger: a claim whose owner never replies goes stale and can be taken over,
+            # and messages past CLAIM_BATCH are left for another instance or a later pass
+            print(f"🤝 {len(lost)} message(s) claimed by another instance or left for a later pass")
+            keep = {uid: h for uid, h in keep.items() if uid in won}
+    if ledger is not None:
+        ledger.record(uidvalidity, ignored, "ignored")
+
+    for uid, raw in iter_text_bodies(conn, list(keep.values())):
+        yield keep[uid], raw
@@ -0,0 +1,142 @@
+"""
+Sir Peepius IMAP IDLE Listener
+Holds a long-lived IDLE session and wakes the bot only when the server
+reports new mail, instead of rescanning the inbox on a fixed timer.
+"""
+
+import imaplib
+import select
+import ssl
+import time
+
+from imap_pool import BROKEN_CONNECTION_ERRORS
+
+# Servers drop IDLE after ~29 minutes (RFC 2177), so renew well before that
+IDLE_RENEW_SECONDS = 25 * 60
+
+
+def _wait_for_data(conn, deadline):
+    """
+    Block until conn has something to read (True) or the deadline passes
+    (False). imaplib's buffered conn.file is checked first, so lines it has
+    already pulled off the socket are never missed.
+    """
+    sock = conn.socket()
+    original_timeout = sock.gettimeout()
+    signalled = False
+    while True:
+        sock.settimeout(0)
+        try:
+            if conn.file.peek(1):
+                return True
+            if signalled:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pass
+        finally:
+            sock.settimeout(original_timeout)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return False
+        signalled = bool(select.select([sock], [], [], remaining)[0])
+
+
+def _read_lines(conn, deadline):
+    """Yield response lines (read with conn.readline) until the deadline passes."""
+    while _wait_for_data(conn, deadline):
+        line = conn.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        yield line.rstrip(b"\r\n")
+
+
+def _is_new_mail(line):
+    return line.startswith(b"* ") and line.upper().endswith((b" EXISTS", b" RECENT"))
+
+
+def idle_wait(conn, timeout=IDLE_RENEW_SECONDS):
+    """
+    Enter IDLE on an authenticated, selected connection and block until the
+    server reports EXISTS/RECENT or the timeout expires.
+
+    Returns True if new mail was announced, False on a plain renewal timeout.
+    """
+    if "IDLE" not in conn.capabilities:
+        raise imaplib.IMAP4.error("server does not support IDLE")
+
+    tag = b"IDLE%d" % int(time.monotonic() * 1000)
+    new_mail = False
+
+    conn.send(tag + b" IDLE\r\n")
+    # Mail that arrived while we were busy is announced just before "+ idling"
+    for line in _read_lines(conn, time.monotonic() + 30):
+        if line.startswith(b"+"):
+            break
+        if _is_new_mail(line):
+            new_mail = True
+        if line.startswith(tag):
+            raise imaplib.IMAP4.error(f"IDLE refused: {line.decode(errors='ignore')}")
+    else:
+        raise imaplib.IMAP4.abort("no IDLE continuation from server")
+
+    # Wait for the server to announce something (or for the renewal timer)
+    if not new_mail:
+        for line in _read_lines(conn, time.monotonic() + timeout):
+            if line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(line.decode(errors="ignore"))
+            if _is_new_mail(line):
+                new_mail = True
+                break
+
+    # Leave IDLE and drain everything up to the tagged completion
+    conn.send(b"DONE\r\n")
+    for line in _read_lines(conn, time.monotonic() + 30):
+        if _is_new_mail(line):
+            new_mail = True
+        if line.startswith(tag):
+            if b" OK" not in line.upper():
+                raise imaplib.IMAP4.error(f"IDLE failed: {line.decode(errors='ignore')}")
+            return new_mail
+    raise imaplib.IMAP4.abort("no IDLE completion from server")
+
+
+def run_idle_loop(pool, on_new_mail, renew_after=IDLE_RENEW_SECONDS,
+                  poll_interval=15, max_backoff=300):
+    """
+    Call on_new_mail() once up front and then every time the server reports
+    new mail. If the IDLE connection drops, poll with exponential backoff
+    until a new IDLE session can be established.
+    """
+    backoff = poll_interval
+
+    def process():
+        try:
+            on_new_mail()
+        except Exception as e:
+            print(f"⚠️ Error processing new mail: {e}")
+            import traceback
+            traceback.print_exc()
+
+    # Catch up on anything that arrived while we were offline
+    process()
+
+    while True:
+        try:
+            with pool.session() as conn:
+                if "IDLE" not in conn.capabilities:
+                    break
+                print("👂 Listening for new mail (IMAP IDLE)…")
+                backoff = poll_interval
+                while True:
+                    if idle_wait(conn, renew_after):
+                        process()
+        except (imaplib.IMAP4.error,) + BROKEN_CONNECTION_ERRORS as e:
+            print(f"⚠️ IDLE connection lost ({e}) — polling again in {backoff}s")
+            time.sleep(backoff)
+            process()
+            backoff = min(backoff * 2, max_backoff)
+
+    print(f"⚠️ Server does not support IDLE — polling every {poll_interval}s instead")
+    while True:
+        time.sleep(poll_interval)
+        process()
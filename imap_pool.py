@@ -0,0 +1,132 @@
+"""
+Sir Peepius IMAP Session Pool
+Keeps logged-in, inbox-selected IMAP connections alive so polls, webhook
+requests and warm Cloud Function invocations skip the TLS + login + select
+round trips.
+"""
+
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+
+# Errors that mean the connection itself is gone (not just a failed command)
+BROKEN_CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class IMAPSessionPool:
+    """A small pool of authenticated IMAP connections with NOOP health checks."""
+
+    def __init__(self, server, user, password, mailbox="inbox",
+                 max_size=2, max_idle=600, timeout=30):
+        self.server = server
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.max_size = max_size
+        self.max_idle = max_idle  # Seconds before an idle connection is assumed dead
+        self.timeout = timeout
+        self._idle = []  # [(conn, last_used)]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _connect(self):
+        """Open a new connection, log in and select the mailbox."""
+        conn = imaplib.IMAP4_SSL(self.server, timeout=self.timeout)
+        conn.login(self.user, self.password)
+        conn.select(self.mailbox)
+        # Remember UIDVALIDITY so UID-keyed caches know which UID space they're in
+        _, data = conn.response("UIDVALIDITY")
+        conn.uidvalidity = int(data[0]) if data and data[0] else None
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.logout()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_alive(conn):
+        """Check a pooled connection with a NOOP."""
+        try:
+            status, _ = conn.noop()
+            return status == "OK"
+        except BROKEN_CONNECTION_ERRORS + (imaplib.IMAP4.error,):
+            return False
+
+    def acquire(self):
+        """Take a healthy connection from the pool, or open a new one."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self.misses += 1
+                    break
+                conn, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.max_idle and self._is_alive(conn):
+                with self._lock:
+                    self.hits += 1
+                return conn
+            with self._lock:
+                self.stale += 1
+            self._close(conn)
+        return self._connect()
+
+    def release(self, conn, broken=False):
+        """Return a connection to the pool (or close it if broken or the pool is full)."""
+        if not broken:
+            with self._lock:
+                if len(self._idle) < self.max_size:
+                    self._idle.append((conn, time.monotonic()))
+                    return
+        self._close(conn)
+
+    @contextmanager
+    def session(self):
+        """Borrow a connection for the duration of a ``with`` block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BROKEN_CONNECTION_ERRORS:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        """Log out every pooled connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "idle": len(self._idle),
+            }
+
+
+# Pools live at module level so they survive across warm Cloud Function invocations
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(server, user, password, mailbox="inbox", **kwargs):
+    """Return the shared pool for this account, creating it on first use."""
+    key = (server, user, mailbox)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = IMAPSessionPool(server, user, password, mailbox, **kwargs)
+            _pools[key] = pool
+        return pool
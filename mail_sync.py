@@ -0,0 +1,100 @@
+"""
+Sir Peepius Incremental Mailbox Sync
+Remembers the last processed UID (per UIDVALIDITY) and Pub/Sub historyId so
+each Gmail notification only fetches the messages that arrived since the
+previous sync, instead of rescanning every unread message. The watermark
+stops below any message still waiting for a reply, so it is retried.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+
+DEFAULT_STATE_FILE = os.path.join(tempfile.gettempdir(), "sir_peepius_sync.json")
+
+_STATUS_RE = re.compile(rb"(UIDVALIDITY|UIDNEXT) (\d+)")
+
+
+def mailbox_status(conn, mailbox="INBOX"):
+    """Return (uidvalidity, uidnext) for the mailbox with a single STATUS command."""
+    typ, data = conn.status(mailbox, "(UIDVALIDITY UIDNEXT)")
+    if typ != "OK":
+        raise RuntimeError(f"STATUS {mailbox} failed: {data}")
+    values = dict(_STATUS_RE.findall(b" ".join(d for d in data if isinstance(d, bytes))))
+    return int(values[b"UIDVALIDITY"]), int(values[b"UIDNEXT"])
+
+
+class MailboxSync:
+    """Tracks how far the mailbox has been processed, persisted to a small JSON file."""
+
+    def __init__(self, path=DEFAULT_STATE_FILE, mailbox="INBOX"):
+        self.path = path
+        self.mailbox = mailbox
+        self.lock = threading.RLock()
+        self.state = self._load()
+        self._synced_through = None
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # Write to a temp file and rename so a crash never leaves half a state file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".sync-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def is_stale(self, history_id):
+        """True if a notification's historyId was already covered by an earlier sync."""
+        if history_id is None:
+            return False
+        return int(history_id) <= self.state.get("history_id", 0)
+
+    def new_uids(self, conn):
+        """
+        Return the UIDs of unread messages that arrived since the last sync.
+
+        Costs one STATUS when nothing is new; otherwise a single UID SEARCH
+        over just the new UID range. On the first run (or after a UIDVALIDITY
+        change) it falls back to a full UNSEEN search.
+        """
+        with self.lock:
+            uidvalidity, uidnext = mailbox_status(conn, self.mailbox)
+            last_uid = self.state.get("last_uid")
+            self._synced_through = uidnext - 1
+
+            if self.state.get("uidvalidity") != uidvalidity or last_uid is None:
+                # No usable baseline yet: everything unread counts as new
+                self.state = {"uidvalidity": uidvalidity, "last_uid": 0,
+                              "history_id": self.state.get("history_id", 0)}
+                _, data = conn.uid("SEARCH", None, "UNSEEN")
+            elif uidnext - 1 <= last_uid:
+                return []
+            else:
+                _, data = conn.uid("SEARCH", None, f"UID {last_uid + 1}:* UNSEEN")
+
+            # "n:*" always matches the highest UID, so filter out anything old
+            last_uid = self.state["last_uid"]
+            return [uid for uid in (data[0] or b"").split() if int(uid) > last_uid]
+
+    def finish(self, history_id=None, unresolved=()):
+        """
+        Mark the delta returned by new_uids() (and its historyId) as synced,
+        up to just below the lowest unresolved UID (a failed reply, a claim
+        lost to another instance), so the next sync looks at it again.
+        """
+        with self.lock:
+            if self._synced_through is not None:
+                synced_through = min([self._synced_through] + [int(uid) - 1 for uid in unresolved])
+                self.state["last_uid"] = max(synced_through, self.state.get("last_uid", 0))
+                self._synced_through = None
+            if history_id is not None:
+                self.state["history_id"] = max(int(history_id), self.state.get("history_id", 0))
+            self._save()
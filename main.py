@@ -1,20 +1,31 @@
 import base64
-import imaplib
-import smtplib
-import email
 import os
 import json
 import sys
+import threading
 import time
 from flask import Flask, request
 try:
     import functions_framework
 except ImportError:
     functions_framework = None  # Will run in local mode
-from email.utils import parseaddr
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
-from openai import OpenAI
+from imap_pool import get_pool
+from smtp_sender import get_sender
+from imap_idle import run_idle_loop
+from imap_fetch import fetch_matching, fetch_headers, iter_text_bodies, mark_answered, mark_failed
+from uid_ledger import UIDLedger, DEFAULT_LEDGER_FILE
+from mail_sync import MailboxSync, DEFAULT_STATE_FILE
+from pipeline import Pipeline, Stage
+from coalesce import NotificationCoalescer
+from claims import make_claims
+from mime_body import parse_message, extract_body
+from reply_parser import clean_reply_text
+from sender_match import SenderMatcher
+from reply_generator import make_reply_generator
+from digest import DigestBatcher
+from conversation_store import thread_key
 
 # Load environment variables from .env file (for local) or environment (for Cloud)
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
@@ -22,11 +33,11 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASS = os.getenv("EMAIL_PASS")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-TARGET_EMAILS_ENV = os.getenv("TARGET_EMAILS", "")
-if not TARGET_EMAILS_ENV:
-    print("❌ Missing TARGET_EMAILS in .env or environment.\nPlease set TARGET_EMAILS to a comma-separated list of addresses.")
+# Built once: exact addresses, @domain wildcards, optional TARGET_EMAILS_FILE and DENY_EMAILS
+SENDER_MATCHER = SenderMatcher.from_env()
+if not len(SENDER_MATCHER):
+    print("❌ No targets configured.\nPlease set TARGET_EMAILS to a comma-separated list of addresses (e.g. TARGET_EMAILS=\"a@x.com,b@y.com\") or point TARGET_EMAILS_FILE at a file with one per line.")
     sys.exit(1)
-TARGET_EMAILS = [e.strip() for e in TARGET_EMAILS_ENV.split(",") if e.strip()]
 
 # Check secrets
 for name, val in {
@@ -42,72 +53,176 @@ IMAP_SERVER = "imap.gmail.com"
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 465
 
+# Shared IMAP connections, reused across polls, webhook requests and warm invocations
+IMAP_POOL = get_pool(IMAP_SERVER, EMAIL_USER, EMAIL_PASS)
+
+# UIDs already ignored or answered, so unread non-target mail isn't re-fetched every poll
+UID_LEDGER = UIDLedger(os.getenv("UID_LEDGER_FILE", DEFAULT_LEDGER_FILE))
+
+# Warm SMTP session; replies are queued and sent over it in the background
+SMTP_SENDER = get_sender(SMTP_SERVER, SMTP_PORT, EMAIL_USER, EMAIL_PASS)
+
+# Atomic per-message claims so parallel instances never answer the same email twice
+CLAIMS = make_claims(os.getenv("CLAIM_BACKEND", "imap"))
+
+# Last processed UID/historyId, so each notification only fetches the delta
+MAILBOX_SYNC = MailboxSync(os.getenv("SYNC_STATE_FILE", DEFAULT_STATE_FILE))
+
 def fetch_email_by_id(message_id):
     """Fetch a specific email by its Gmail message ID."""
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL_USER, EMAIL_PASS)
-        mail.select("inbox")
-        
-        # Search for the specific message
-        _, data = mail.search(None, f"X-GM-MSGID {message_id}")
-        
-        if not data[0]:
+        with IMAP_POOL.session() as mail:
+            # Search for the specific message
+            _, data = mail.uid("SEARCH", None, f"X-GM-MSGID {message_id}")
+            
+            if not data[0]:
+                print(f"Message {message_id} not found")
+                return None
+            
+            uid = data[0].split()[0]
+            # Only the text part, capped; attachments are never downloaded
+            raw_messages = [raw for _, raw in iter_text_bodies(mail, fetch_headers(mail, [uid]))]
+        if not raw_messages:
             print(f"Message {message_id} not found")
-            mail.logout()
             return None
-        
-        num = data[0].split()[0]
-        _, msg_data = mail.fetch(num, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
+        msg = parse_message(raw_messages[0])
         
         subject = msg["subject"] or "(no subject)"
         sender = msg["from"] or ""
-        body = ""
+        body = clean_reply_text(extract_body(msg))
         
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    body += part.get_payload(decode=True).decode(errors="ignore")
-        else:
-            body = msg.get_payload(decode=True).decode(errors="ignore")
-        
-        mail.logout()
         return (sender, subject, body)
     except Exception as e:
         print(f"Error fetching email: {e}")
         return None
 
-def generate_reply(text):
+SYSTEM_PROMPT = "You are sir peepius aurelius of chickenopolis. You are a very noble chicken, and you are very proud."
+# Reply cache, fast/strong model routing, completion deadlines and OpenAI rate limits
+REPLIES = make_reply_generator(OPENAI_API_KEY, SYSTEM_PROMPT, strong_default="gpt-4o")
+
+def generate_reply(text, subject=""):
     """Generate a reply using OpenAI."""
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    messages = [
-        {"role": "system", "content": "You are sir peepius aurelius of chickenopolis. You are a very noble chicken, and you are very proud."},
-        {"role": "user", "content": text}
-    ]
-    response = client.chat.completions.create(model="gpt-4o", messages=messages)
-    return response.choices[0].message.content.strip()
+    return REPLIES.generate(text, subject)
 
-def send_email(to_addr, subject, body):
-    """Send an email reply."""
+def build_reply(to_addr, subject, body, in_reply_to=None, references=None):
+    """Build the signed reply message (threaded under in_reply_to when given)."""
     msg = MIMEText(body + "\n\n— Sir Peepius Aurelius of Chickenopolis 🦊⚓")
     msg["Subject"] = f"Re: {subject}"
     msg["From"] = EMAIL_USER
     msg["To"] = to_addr
-    
-    with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-        server.login(EMAIL_USER, EMAIL_PASS)
-        server.send_message(msg)
-    print(f"📨 Replied to {to_addr}!")
+    if in_reply_to:
+        msg["In-Reply-To"] = in_reply_to
+        msg["References"] = references or in_reply_to
+    return msg
+
+def send_email(to_addr, subject, body):
+    """Queue an email reply on the shared SMTP session."""
+    # Sent in the background over the shared, already-authenticated session
+    SMTP_SENDER.enqueue(build_reply(to_addr, subject, body))
 
 def should_reply_to_sender(sender):
-    """Check if we should reply to this sender based on TARGET_EMAILS."""
-    parsed_sender = parseaddr(sender)[1] or sender
-    matches_target = any(
-        (t.lower() == parsed_sender.lower()) or (t.lower() in sender.lower())
-        for t in TARGET_EMAILS
+    """Check if we should reply to this sender based on TARGET_EMAILS (and DENY_EMAILS)."""
+    return SENDER_MATCHER.check(sender)
+
+def is_target_message(headers):
+    """Header-phase filter: only target senders get their bodies downloaded."""
+    should_reply, _ = should_reply_to_sender(headers["from"])
+    if not should_reply:
+        print(f"🦢 Ignoring {headers['from']} — not one of the targets.")
+    return should_reply
+
+def parse_email(item):
+    """Pipeline stage: turn a fetched (headers, raw message) pair into a reply job."""
+    headers, raw = item
+    msg = parse_message(raw)
+    
+    subject = msg["subject"] or "(no subject)"
+    sender = msg["from"] or ""
+    body = clean_reply_text(extract_body(msg))
+    
+    _, parsed_sender = should_reply_to_sender(sender)
+    message_id = str(msg["message-id"] or headers.get("message_id") or "").strip()
+    return {"uid": headers["id"], "sender": sender, "to": parsed_sender, "subject": subject, "body": body,
+            "in_reply_to": message_id, "references": message_id}
+
+def job_uids(job):
+    """The UIDs a job answers (a list in digest mode)."""
+    return job["uid"] if isinstance(job["uid"], list) else [job["uid"]]
+
+def draft_reply(job):
+    """Pipeline stage: ask OpenAI for Sir Peepius' reply."""
+    print(f"📜 From {job['sender']}: {job['subject']}")
+    try:
+        job["reply"] = generate_reply(job["body"], job["subject"])
+    except Exception:
+        # Left unread for the next sync, up to REPLY_MAX_ATTEMPTS tries
+        mark_failed(IMAP_POOL, job_uids(job), UID_LEDGER)
+        raise
+    return job
+
+def combine_digest(jobs):
+    """Merge a burst of jobs from one sender into one job answered by one reply."""
+    if len(jobs) == 1:
+        return jobs[0]
+    print(f"🧺 Answering {len(jobs)} emails from {jobs[0]['to']} in one reply")
+    body = f"{len(jobs)} emails arrived close together. Answer them all in one reply.\n\n" + "\n\n".join(
+        f"--- Email {i} (Subject: {job['subject']}) ---\n{job['body']}" for i, job in enumerate(jobs, 1)
     )
-    return matches_target, parsed_sender
+    message_ids = [job["in_reply_to"] for job in jobs if job["in_reply_to"]]
+    return {
+        "uid": [job["uid"] for job in jobs],
+        "sender": jobs[-1]["sender"],
+        "to": jobs[-1]["to"],
+        "subject": jobs[0]["subject"],
+        "body": body,
+        "in_reply_to": message_ids[-1] if message_ids else "",
+        "references": " ".join(message_ids),
+    }
+
+def draft_digest(jobs):
+    """Pipeline stage (digest mode): one completion for a whole group."""
+    return draft_reply(combine_digest(jobs))
+
+def digest_key(job):
+    """Group by sender, or by sender and thread with DIGEST_BY=thread."""
+    if os.getenv("DIGEST_BY", "sender").lower() == "thread":
+        return job["to"].lower(), thread_key(job["subject"])
+    return job["to"].lower()
+
+def deliver_reply(job):
+    """Pipeline stage: send the reply over the warm SMTP session."""
+    try:
+        SMTP_SENDER.send(build_reply(job["to"], job["subject"], job["reply"], job["in_reply_to"], job["references"]))
+    except Exception:
+        mark_failed(IMAP_POOL, job_uids(job), UID_LEDGER)
+        raise
+    print(f"📨 Replied to {job['to']}!")
+    mark_answered(IMAP_POOL, job_uids(job), UID_LEDGER)
+    return job
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    """Start the parse → generate → send worker pools on first use."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+            llm_workers = int(os.getenv("PIPELINE_LLM_WORKERS", "8"))
+            digest_window = float(os.getenv("DIGEST_WINDOW", "0"))
+            stages = [Stage("parse", parse_email, int(os.getenv("PIPELINE_PARSE_WORKERS", "2")), queue_size)]
+            if digest_window > 0:
+                # Digest mode: bursts from one sender share a completion and a reply
+                stages += [
+                    DigestBatcher(digest_key, digest_window, int(os.getenv("DIGEST_MAX_MESSAGES", "10"))),
+                    Stage("generate", draft_digest, llm_workers, queue_size),
+                ]
+            else:
+                stages.append(Stage("generate", draft_reply, llm_workers, queue_size))
+            stages.append(Stage("send", deliver_reply, int(os.getenv("PIPELINE_SEND_WORKERS", "1")), queue_size))
+            _pipeline = Pipeline(stages)
+        return _pipeline
 
 def handle_gmail_notification(cloud_event=None):
     """
@@ -122,55 +237,12 @@ def handle_gmail_notification(cloud_event=None):
         notification = json.loads(pubsub_message)
         
         print(f"Received Gmail notification: {notification}")
+        print(f"🔌 IMAP pool: {IMAP_POOL.stats()} | SMTP: {SMTP_SENDER.stats()}")
         
-        # Extract the message ID (historyId is sent, but we need to fetch the actual email)
-        # Note: Gmail push notifications contain historyId, not individual message IDs
-        # We'll need to check recent unread messages instead
-        
-        # Fetch recent unread emails (since Gmail notifications don't include message content)
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL_USER, EMAIL_PASS)
-        mail.select("inbox")
-        
-        # Get the most recent unread message
-        _, data = mail.search(None, "UNSEEN")
-        
-        if not data[0]:
-            print("No unread messages found")
-            mail.logout()
-            return "No unread messages", 200
-        
-        # Process only the most recent unread message
-        message_nums = data[0].split()
-        latest_num = message_nums[-1]
-        
-        _, msg_data = mail.fetch(latest_num, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
-        
-        subject = msg["subject"] or "(no subject)"
-        sender = msg["from"] or ""
-        body = ""
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    body += part.get_payload(decode=True).decode(errors="ignore")
-        else:
-            body = msg.get_payload(decode=True).decode(errors="ignore")
-        
-        mail.logout()
-        
-        # Check if we should reply to this sender
-        should_reply, parsed_sender = should_reply_to_sender(sender)
-        
-        if should_reply:
-            print(f"📜 From {sender}: {subject}")
-            reply = generate_reply(body)
-            send_email(parsed_sender, subject, reply)
-            return f"Replied to {parsed_sender}", 200
-        else:
-            print(f"🦢 Ignoring {sender} — not one of the targets.")
-            return f"Ignored {sender}", 200
+        # Gmail push notifications carry a historyId, not message IDs, so sync
+        # everything that arrived since the last notification we handled.
+        # Bursts of notifications share one sync.
+        return SYNC_COALESCER.notify(notification.get("historyId"), wait=True)
             
     except Exception as e:
         print(f"Error processing notification: {e}")
@@ -178,56 +250,37 @@ def handle_gmail_notification(cloud_event=None):
         traceback.print_exc()
         return f"Error: {str(e)}", 500
 
+def process_unread_emails():
+    """Check the inbox once and reply to every unread message from a target."""
+    with IMAP_POOL.session() as mail:
+        _, data = mail.uid("SEARCH", None, "UNSEEN")
+        
+        if not data[0]:
+            print("🌊 No new messages…")
+            return
+        
+        # Process unread messages (headers first, bodies only for targets),
+        # streamed from a single UID FETCH as each one arrives
+        uids = data[0].split()
+        
+        # Fetched messages stream straight into the parse → generate → send pipeline
+        pipeline = get_pipeline()
+        for item in fetch_matching(mail, uids, is_target_message, ledger=UID_LEDGER, claims=CLAIMS):
+            pipeline.submit(item)
+    
+    pipeline.join()
+
 def main_local():
     """Run in local polling mode for testing."""
     print("✅ All secrets loaded. Sir Peepius is ready to sail!")
-    print(f"🦊 Sir Peepius standin' by, replyin' only to {', '.join(TARGET_EMAILS)}\n")
+    print(f"🦊 Sir Peepius standin' by, replyin' only to {len(SENDER_MATCHER)} target(s)\n")
     print("📡 Running in LOCAL MODE (polling every 15 seconds)")
     print("💡 Press Ctrl+C to stop\n")
     
     while True:
         try:
             # Simulate a notification event by checking for unread emails
-            mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-            mail.login(EMAIL_USER, EMAIL_PASS)
-            mail.select("inbox")
-            
-            _, data = mail.search(None, "UNSEEN")
-            
-            if not data[0]:
-                print("🌊 No new messages…")
-                mail.logout()
-            else:
-                # Process unread messages
-                message_nums = data[0].split()
-                
-                for num in message_nums:
-                    _, msg_data = mail.fetch(num, "(RFC822)")
-                    msg = email.message_from_bytes(msg_data[0][1])
-                    
-                    subject = msg["subject"] or "(no subject)"
-                    sender = msg["from"] or ""
-                    body = ""
-                    
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            if part.get_content_type() == "text/plain":
-                                body += part.get_payload(decode=True).decode(errors="ignore")
-                    else:
-                        body = msg.get_payload(decode=True).decode(errors="ignore")
-                    
-                    # Check if we should reply to this sender
-                    should_reply, parsed_sender = should_reply_to_sender(sender)
-                    
-                    if should_reply:
-                        print(f"📜 From {sender}: {subject}")
-                        reply = generate_reply(body)
-                        send_email(parsed_sender, subject, reply)
-                    else:
-                        print(f"🦢 Ignoring {sender} — not one of the targets.")
-                
-                mail.logout()
-            
+            process_unread_emails()
             time.sleep(15)
             
         except KeyboardInterrupt:
@@ -239,51 +292,49 @@ def main_local():
             traceback.print_exc()
             time.sleep(15)
 
-def process_latest_email():
-    """Process the most recent unread email."""
+def main_idle():
+    """Run in IMAP IDLE mode: wake up only when Gmail reports new mail."""
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(EMAIL_USER, EMAIL_PASS)
-        mail.select("inbox")
-        
-        _, data = mail.search(None, "UNSEEN")
-        
-        if not data[0]:
-            print("No unread messages found")
-            mail.logout()
-            return "No unread messages", 200
-        
-        # Process the most recent unread message
-        message_nums = data[0].split()
-        latest_num = message_nums[-1]
-        
-        _, msg_data = mail.fetch(latest_num, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
-        
-        subject = msg["subject"] or "(no subject)"
-        sender = msg["from"] or ""
-        body = ""
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    body += part.get_payload(decode=True).decode(errors="ignore")
-        else:
-            body = msg.get_payload(decode=True).decode(errors="ignore")
-        
-        mail.logout()
-        
-        # Check if we should reply to this sender
-        should_reply, parsed_sender = should_reply_to_sender(sender)
-        
-        if should_reply:
-            print(f"📜 From {sender}: {subject}")
-            reply = generate_reply(body)
-            send_email(parsed_sender, subject, reply)
-            return f"Replied to {parsed_sender}", 200
-        else:
-            print(f"🦢 Ignoring {sender} — not one of the targets.")
-            return f"Ignored {sender}", 200
+        run_idle_loop(IMAP_POOL, process_unread_emails)
+    except KeyboardInterrupt:
+        print("\n\n🛑 Sir Peepius signing off. Fair winds!")
+        sys.exit(0)
+
+def sync_new_emails(history_id=None):
+    """Fetch only the unread messages that arrived since the last sync and reply to targets."""
+    try:
+        with MAILBOX_SYNC.lock:
+            if MAILBOX_SYNC.is_stale(history_id):
+                print(f"⏭️ historyId {history_id} already synced")
+                return "Already synced", 200
+            
+            pipeline = get_pipeline()
+            targets = 0
+            seen = set()
+            while True:
+                deferred = CLAIMS.deferred if CLAIMS else 0
+                with IMAP_POOL.session() as mail:
+                    uids = MAILBOX_SYNC.new_uids(mail)
+                    uidvalidity = getattr(mail, "uidvalidity", None)
+                    seen.update(uids)
+                    # Headers first, so non-target mail never has its body downloaded;
+                    # matches stream straight into the parse → generate → send pipeline
+                    for item in fetch_matching(mail, uids, is_target_message, ledger=UID_LEDGER, claims=CLAIMS):
+                        pipeline.submit(item)
+                        targets += 1
+                
+                # Replies must be out before a Cloud Function invocation returns
+                pipeline.join()
+                # Claims stop at CLAIM_BATCH per pass, leaving the rest to other instances:
+                # take another batch only once this one has been answered
+                if CLAIMS is None or CLAIMS.deferred == deferred:
+                    break
+            
+            if not seen:
+                print("No new messages found")
+            # Anything neither ignored nor answered (failed, or claimed elsewhere) is looked at again next sync
+            MAILBOX_SYNC.finish(history_id, unresolved=UID_LEDGER.filter_new(uidvalidity, uids))
+            return f"Answered {targets} target emails, ignored {len(seen) - targets}", 200
             
     except Exception as e:
         print(f"Error processing email: {e}")
@@ -291,37 +342,40 @@ def process_latest_email():
         traceback.print_exc()
         return f"Error: {str(e)}", 500
 
+# Notifications arriving within the window (or while a sync runs) share one sync
+SYNC_COALESCER = NotificationCoalescer(sync_new_emails, float(os.getenv("COALESCE_WINDOW", "0.5")))
+
 # Flask app for local webhook server
 app = Flask(__name__)
 
 @app.route('/gmail-webhook', methods=['POST'])
 def webhook():
-    """Handle Gmail push notifications locally."""
-    try:
-        # Get the Pub/Sub message
-        envelope = request.get_json()
-        
-        if not envelope:
-            print("❌ No Pub/Sub message received")
-            return "Bad Request: no Pub/Sub message", 400
-        
-        # Decode the message
-        if 'message' in envelope:
-            pubsub_message = envelope['message']
-            if 'data' in pubsub_message:
+    """Handle Gmail push notifications locally: validate, enqueue and ack right away."""
+    # Get the Pub/Sub message
+    envelope = request.get_json(silent=True)
+    
+    if not envelope:
+        print("❌ No Pub/Sub message received")
+        return "Bad Request: no Pub/Sub message", 400
+    
+    # Decode the message
+    history_id = None
+    if 'message' in envelope:
+        pubsub_message = envelope['message']
+        if 'data' in pubsub_message:
+            try:
                 data = base64.b64decode(pubsub_message['data']).decode()
                 notification = json.loads(data)
-                print(f"📨 Received Gmail notification: {notification}")
-        
-        # Process the latest email
-        result, status = process_latest_email()
-        return result, status
-        
-    except Exception as e:
-        print(f"Error in webhook: {e}")
-        import traceback
-        traceback.print_exc()
-        return f"Error: {str(e)}", 500
+            except (ValueError, TypeError) as e:
+                print(f"❌ Undecodable Pub/Sub data: {e}")
+                return "Bad Request: invalid message data", 400
+            history_id = notification.get("historyId")
+            print(f"📨 Received Gmail notification: {notification}")
+    
+    # Sync in the background so Pub/Sub gets its ack well inside the deadline;
+    # bursts of notifications are merged into a single sync
+    SYNC_COALESCER.notify(history_id)
+    return "", 204
 
 @app.route('/gmail-webhook', methods=['GET'])
 def webhook_verify():
@@ -331,13 +385,26 @@ def webhook_verify():
 @app.route('/', methods=['GET'])
 def health():
     """Health check endpoint."""
-    return f"Sir Peepius is ready! Monitoring: {', '.join(TARGET_EMAILS)}", 200
+    return f"Sir Peepius is ready! Monitoring {len(SENDER_MATCHER)} target(s)", 200
+
+@app.route('/status', methods=['GET'])
+def status():
+    """Connection pool, sender, notification and pipeline counters/timings."""
+    return {
+        "imap_pool": IMAP_POOL.stats(),
+        "uid_ledger": UID_LEDGER.stats(),
+        "smtp": SMTP_SENDER.stats(),
+        "notifications": SYNC_COALESCER.stats(),
+        "claims": CLAIMS.stats() if CLAIMS else None,
+        **REPLIES.stats(),
+        "pipeline": get_pipeline().stats(),
+    }, 200
 
 if __name__ == "__main__":
     print("✅ All secrets loaded. Sir Peepius is ready to sail!")
-    print(f"🦊 Sir Peepius standin' by, replyin' only to {', '.join(TARGET_EMAILS)}\n")
+    print(f"🦊 Sir Peepius standin' by, replyin' only to {len(SENDER_MATCHER)} target(s)\n")
     
-    # Check if we should run in webhook mode or polling mode
+    # Check if we should run in webhook, idle or polling mode
     mode = os.getenv("MODE", "webhook").lower()
     
     if mode == "webhook":
@@ -348,6 +415,10 @@ if __name__ == "__main__":
         print("   2. Configure Gmail watch to push to your ngrok URL")
         print("   3. Press Ctrl+C to stop\n")
         app.run(host='0.0.0.0', port=8080, debug=False)
+    elif mode == "idle":
+        print("📡 Running in IDLE MODE (IMAP push, falls back to polling)")
+        print("💡 Press Ctrl+C to stop\n")
+        main_idle()
     else:
         print("📡 Running in POLLING MODE (checking every 15 seconds)")
         print("💡 Press Ctrl+C to stop\n")
@@ -0,0 +1,214 @@
+"""
+Sir Peepius Memory Index
+Optional semantic recall for the memory bot: every stored turn is embedded
+and its vector appended to a memory-mapped NumPy array, and the turns most
+similar to an incoming email are found with one vectorized dot product.
+
+Needs numpy (pip install numpy); without it AVAILABLE is False and the bot
+simply runs without recall. Embedders are pluggable: anything with a `dim`
+attribute and an embed(texts) -> float32 array of unit rows. HashingEmbedder
+is a deterministic, offline stand-in; OpenAIEmbedder uses the embeddings API.
+
+One process should write to an index at a time; reads are lock-free.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+from reply_parser import estimate_tokens
+
+try:
+    import numpy as np
+    AVAILABLE = True
+except ImportError:
+    np = None
+    AVAILABLE = False
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little", signed=True)
+
+
+class HashingEmbedder:
+    """Feature-hashed bag of words (and word pairs). Deterministic and free, but only lexical."""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD_RE.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = _hash64(feature)
+                vectors[row, h % self.dim] += 1.0 if h & 1 << 40 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API (shares the bot's pooled client and, if given, its rate limiter)."""
+
+    def __init__(self, client, model="text-embedding-3-small", dim=1536, limiter=None, timeout=30):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.limiter = limiter
+        self.timeout = timeout
+
+    def embed(self, texts):
+        if self.limiter is not None:
+            if self.limiter.acquire(sum(estimate_tokens(text) for text in texts), self.timeout) is False:
+                raise TimeoutError("rate limit wait would overrun the embedding deadline")
+        client = self.client.with_options(timeout=self.timeout)
+        response = client.embeddings.create(model=self.model, input=list(texts))
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """
+    Append-only vectors in <path>.f32, with the turn id and owner (sender
+    hash) of each row in <path>.ids / <path>.owner and the row count in
+    <path>.json. Capacity doubles as it fills.
+    """
+
+    def __init__(self, path, embedder, initial_capacity=1024):
+        if not AVAILABLE:
+            raise RuntimeError("numpy is required for the memory index")
+        self.path = path
+        self.embedder = embedder
+        self.dim = embedder.dim
+        self._lock = threading.Lock()
+        self.count = 0
+        if os.path.exists(path + ".json"):
+            with open(path + ".json") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim:
+                raise ValueError(f"index {path} has dim {meta['dim']}, embedder has {self.dim}")
+            self.count = meta["count"]
+        existing = os.path.getsize(path + ".f32") // (4 * self.dim) if os.path.exists(path + ".f32") else 0
+        self._open(max(initial_capacity, existing, self.count))
+
+    def _open(self, capacity):
+        for suffix, itemsize in ((".f32", 4 * self.dim), (".ids", 8), (".owner", 8)):
+            with open(self.path + suffix, "ab") as f:
+                if f.tell() < capacity * itemsize:
+                    f.truncate(capacity * itemsize)
+        self.capacity = capacity
+        self._vectors = np.memmap(self.path + ".f32", dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._ids = np.memmap(self.path + ".ids", dtype=np.int64, mode="r+", shape=(capacity,))
+        self._owners = np.memmap(self.path + ".owner", dtype=np.int64, mode="r+", shape=(capacity,))
+
+    def _save_meta(self):
+        tmp = self.path + ".json.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count}, f)
+        os.replace(tmp, self.path + ".json")
+
+    def add_vectors(self, owner, ids, vectors):
+        """Append already-embedded rows (unit vectors) for one owner."""
+        with self._lock:
+            needed = self.count + len(ids)
+            if needed > self.capacity:
+                for array in (self._vectors, self._ids, self._owners):
+                    array.flush()
+                capacity = self.capacity
+                while capacity < needed:
+                    capacity *= 2
+                self._open(capacity)
+            rows = slice(self.count, needed)
+            self._vectors[rows] = vectors
+            self._ids[rows] = ids
+            self._owners[rows] = _hash64(owner.lower())
+            for array in (self._vectors, self._ids, self._owners):
+                array.flush()
+            self.count = needed
+            self._save_meta()
+
+    def add(self, owner, turns):
+        """Embed and append [(turn_id, text), ...]."""
+        if turns:
+            ids, texts = zip(*turns)
+            self.add_vectors(owner, ids, self.embedder.embed(texts))
+
+    def indexed_ids(self):
+        """Turn ids that already have a vector."""
+        with self._lock:
+            return set(self._ids[:self.count].tolist())
+
+    def catch_up(self, store, chunk=256):
+        """
+        Embed the turns in a ConversationStore that have no vector yet (turns
+        saved before recall was enabled, a migrated memory file, failed adds).
+        Returns how many were added.
+        """
+        indexed = self.indexed_ids()
+        after_id = 0
+        added = 0
+        while True:
+            rows = store.turns_after(after_id, chunk)
+            if not rows:
+                return added
+            after_id = rows[-1][0]
+            by_owner = {}
+            for turn_id, sender, content in rows:
+                if turn_id not in indexed:
+                    by_owner.setdefault(sender, []).append((turn_id, content))
+            for owner, turns in by_owner.items():
+                self.add(owner, turns)
+                added += len(turns)
+
+    def search(self, owner, text, k=3, exclude_ids=(), min_score=0.0):
+        """Top-k (turn_id, similarity) of this owner's rows scoring above min_score, most similar first."""
+        count = self.count
+        if not count:
+            return []
+        query = self.embedder.embed([text])[0]
+        scores = self._vectors[:count] @ query
+        scores[self._owners[:count] != _hash64(owner.lower())] = -np.inf
+        if exclude_ids:
+            scores[np.isin(self._ids[:count], list(exclude_ids))] = -np.inf
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._ids[i]), float(scores[i])) for i in top if scores[i] > min_score]
+
+    def stats(self):
+        return {"rows": self.count, "capacity": self.capacity, "dim": self.dim}
+
+
+if __name__ == "__main__":
+    # Benchmark: retrieval latency at 100k stored turns
+    import sys
+    import tempfile
+    import time
+
+    if not AVAILABLE:
+        sys.exit("numpy is not installed")
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    embedder = HashingEmbedder(dim=256)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = VectorIndex(os.path.join(tmp, "bench"), embedder)
+        rng = np.random.default_rng(7)
+        start = time.perf_counter()
+        for first in range(0, rows, 10_000):
+            batch = rng.standard_normal((min(10_000, rows - first), embedder.dim), dtype=np.float32)
+            batch /= np.linalg.norm(batch, axis=1, keepdims=True)
+            index.add_vectors(f"sender{first // 10_000 % 10}@example.com", np.arange(first, first + len(batch)), batch)
+        print(f"🐔 Loaded {rows} vectors in {time.perf_counter() - start:.2f}s")
+
+        timings = []
+        for i in range(200):
+            start = time.perf_counter()
+            index.search(f"sender{i % 10}@example.com", f"when does the ship sail {i}", k=5)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        pct = lambda p: timings[int(p * (len(timings) - 1))] * 1000
+        print(f"🔎 search over {rows} rows: p50 {pct(0.5):.2f} ms, p95 {pct(0.95):.2f} ms, p99 {pct(0.99):.2f} ms")
@@ -0,0 +1,101 @@
+"""
+Sir Peepius MIME Body Extractor
+One shared way to get the readable text out of an email: the first plain
+text part (or, failing that, the first HTML part converted to text),
+decoded with its declared charset and capped at MAX_BODY_BYTES. Only the
+chosen part is ever decoded; attachments are never touched.
+"""
+
+import base64
+import binascii
+import codecs
+import html
+import os
+import quopri
+import re
+from email import policy
+from email.parser import BytesParser
+
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", "65536"))
+
+_parser = BytesParser(policy=policy.default)
+
+_HTML_DROP_RE = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK_RE = re.compile(r"<\s*(br|/p|/div|/li|/tr|/h[1-6])\b[^>]*>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_SPACES_RE = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+
+def parse_message(raw):
+    """Parse raw RFC822 bytes with the modern email policy."""
+    return _parser.parsebytes(raw)
+
+
+def html_to_text(markup):
+    """Cheap HTML → text: drop scripts/styles, turn block ends into newlines, strip tags."""
+    text = _HTML_DROP_RE.sub("", markup)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    text = html.unescape(_HTML_TAG_RE.sub("", text))
+    text = _SPACES_RE.sub(" ", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def encoded_size(encoding, max_bytes):
+    """How many transfer-encoded bytes it takes to carry max_bytes of content."""
+    encoding = (encoding or "7bit").lower()
+    if encoding == "base64":
+        # 4 chars per 3 bytes, plus a line break every 76 chars
+        return max_bytes * 78 // 57 + 4
+    if encoding == "quoted-printable":
+        return max_bytes * 3
+    return max_bytes
+
+
+def _decode_text(part, max_bytes):
+    """Decode just the first max_bytes of a text part with its declared charset."""
+    encoding = str(part.get("content-transfer-encoding", "7bit")).strip().lower()
+    # For 7bit/8bit parts the parser already decoded the charset for us
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        return ""
+    if encoding == "base64":
+        chunk = "".join(payload[: encoded_size(encoding, max_bytes)].split())
+        chunk = chunk[: len(chunk) - len(chunk) % 4]
+        try:
+            data = base64.b64decode(chunk)[:max_bytes]
+        except (binascii.Error, ValueError):
+            return ""
+    elif encoding == "quoted-printable":
+        data = quopri.decodestring(payload[: encoded_size(encoding, max_bytes)].encode("ascii", "replace"))[:max_bytes]
+    else:
+        return payload[:max_bytes]
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = "utf-8"
+    return data.decode(charset, errors="replace")
+
+
+def extract_body(msg, max_bytes=MAX_BODY_BYTES):
+    """
+    Return the readable body of a parsed message (or raw bytes).
+
+    Stops at the first text/plain part that isn't an attachment; falls back
+    to the first text/html part converted to plain text.
+    """
+    if isinstance(msg, (bytes, bytearray)):
+        msg = parse_message(msg)
+    html_part = None
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            return _decode_text(part, max_bytes)
+        if content_type == "text/html" and html_part is None:
+            html_part = part
+    if html_part is not None:
+        return html_to_text(_decode_text(html_part, max_bytes))
+    return ""
@@ -0,0 +1,96 @@
+"""
+Sir Peepius Model Router
+Sends quick notes ("thanks!") to a fast, cheap model and long or
+question-heavy mail to the strong one, based on features that cost next to
+nothing to compute: length, questions per 100 tokens and thread depth.
+Every decision and the completion latency of each tier are recorded (and
+optionally appended to a JSONL log) so the thresholds can be tuned.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from reply_parser import estimate_tokens
+
+_REPLY_PREFIX_RE = re.compile(r"\b(re|aw|sv)\s*(\[\d+\])?\s*:", re.IGNORECASE)
+_QUESTION_RE = re.compile(r"\?+")
+
+
+def features(text, subject="", depth=None):
+    """Cheap routing features of an inbound message."""
+    tokens = estimate_tokens(text or "")
+    questions = len(_QUESTION_RE.findall(text or ""))
+    return {
+        "tokens": tokens,
+        "questions": questions,
+        "question_density": round(100 * questions / max(tokens, 1), 2),
+        "depth": depth if depth is not None else len(_REPLY_PREFIX_RE.findall(str(subject or ""))),
+    }
+
+
+class ModelRouter:
+    """route() picks "fast" or "strong"; timing(tier) records how long that tier's completions take."""
+
+    def __init__(self, fast_model, strong_model, max_fast_tokens=150, max_fast_questions=1,
+                 max_fast_depth=2, log_path=None, window=200):
+        self.models = {"fast": fast_model, "strong": strong_model}
+        self.max_fast_tokens = max_fast_tokens
+        self.max_fast_questions = max_fast_questions
+        self.max_fast_depth = max_fast_depth
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._routed = {"fast": 0, "strong": 0}
+        self._latencies = {"fast": deque(maxlen=window), "strong": deque(maxlen=window)}
+
+    @classmethod
+    def from_env(cls, strong_default):
+        """FAST_MODEL / STRONG_MODEL and ROUTER_* thresholds from the environment."""
+        return cls(
+            fast_model=os.getenv("FAST_MODEL", "gpt-4o-mini"),
+            strong_model=os.getenv("STRONG_MODEL", strong_default),
+            max_fast_tokens=int(os.getenv("ROUTER_FAST_MAX_TOKENS", "150")),
+            max_fast_questions=int(os.getenv("ROUTER_FAST_MAX_QUESTIONS", "1")),
+            max_fast_depth=int(os.getenv("ROUTER_FAST_MAX_DEPTH", "2")),
+            log_path=os.getenv("ROUTER_LOG") or None,
+        )
+
+    def route(self, text, subject="", depth=None):
+        """Return (tier, model) for this message and record the decision."""
+        f = features(text, subject, depth)
+        fast = (f["tokens"] <= self.max_fast_tokens
+                and f["questions"] <= self.max_fast_questions
+                and f["depth"] <= self.max_fast_depth)
+        tier = "fast" if fast else "strong"
+        with self._lock:
+            self._routed[tier] += 1
+            if self.log_path:
+                with open(self.log_path, "a") as log:
+                    log.write(json.dumps({"at": time.time(), "tier": tier, "model": self.models[tier], **f}) + "\n")
+        return tier, self.models[tier]
+
+    @contextmanager
+    def timing(self, tier):
+        """Time one completion on a tier (only successful calls are recorded)."""
+        start = time.monotonic()
+        yield
+        with self._lock:
+            self._latencies[tier].append(time.monotonic() - start)
+
+    def stats(self):
+        with self._lock:
+            tiers = {}
+            for tier, model in self.models.items():
+                samples = sorted(self._latencies[tier])
+                tiers[tier] = {
+                    "model": model,
+                    "routed": self._routed[tier],
+                    "samples": len(samples),
+                    "p50_seconds": round(samples[len(samples) // 2], 3) if samples else None,
+                    "p95_seconds": round(samples[int(0.95 * (len(samples) - 1))], 3) if samples else None,
+                }
+            return tiers
@@ -0,0 +1,49 @@
+"""
+Sir Peepius Shared OpenAI Client
+One lazily created client per API key, so every reply reuses the same
+HTTP keep-alive pool instead of paying a fresh TLS handshake per email.
+"""
+
+import importlib.util
+import os
+import threading
+
+import httpx
+from openai import OpenAI
+
+# Connection pool and timeout knobs (override via environment)
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "10"))
+MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "5"))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+REQUEST_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "50"))
+
+# httpx only speaks HTTP/2 when h2 is installed
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _build_http_client():
+    return httpx.Client(
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+def get_openai_client(api_key):
+    """Return the shared OpenAI client for this key, creating it on first use (thread-safe)."""
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                client = OpenAI(api_key=api_key, http_client=_build_http_client())
+                _clients[api_key] = client
+    return client
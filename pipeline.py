@@ -0,0 +1,100 @@
+"""
+Sir Peepius Staged Pipeline
+Runs each step of answering mail (parse → generate → send) in its own pool
+of worker threads, connected by bounded queues. A slow LLM call no longer
+blocks the messages queued behind it, and a full queue pushes back on the
+stage feeding it.
+"""
+
+import queue
+import threading
+import time
+import traceback
+
+
+class Stage:
+    """One step of the pipeline: a bounded input queue and a pool of workers."""
+
+    def __init__(self, name, func, workers=1, queue_size=16):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True).start()
+
+    def put(self, item, block=True):
+        """Queue an item for this stage (raises queue.Full if block=False and it's full)."""
+        self.queue.put((time.monotonic(), item), block=block)
+
+    def join(self):
+        """Wait until every item queued so far has been processed."""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            queued_at, item = self.queue.get()
+            start = time.monotonic()
+            try:
+                result = self.func(item)
+                with self._lock:
+                    self.processed += 1
+                    self.busy_seconds += time.monotonic() - start
+                    self.wait_seconds += start - queued_at
+                # None means "drop this item" (e.g. filtered out)
+                if result is not None and self.next is not None:
+                    self.next.put(result)  # Blocks when the next stage is backed up
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"⚠️ Pipeline stage '{self.name}' failed: {e}")
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started_at if self.started_at else 0
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue.qsize(),
+                "processed": self.processed,
+                "errors": self.errors,
+                "avg_seconds": round(self.busy_seconds / self.processed, 3) if self.processed else None,
+                "avg_wait_seconds": round(self.wait_seconds / self.processed, 3) if self.processed else None,
+                "per_minute": round(60 * self.processed / elapsed, 1) if elapsed else None,
+            }
+
+
+class Pipeline:
+    """A chain of stages. submit() feeds the first stage; join() waits for everything to drain."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+        for stage in stages:
+            stage.start()
+
+    def submit(self, item, block=True):
+        """Hand an item to the first stage (blocks while that stage's queue is full)."""
+        self.stages[0].put(item, block)
+
+    def join(self):
+        """Wait until every submitted item has left the last stage."""
+        # Workers hand items on before marking them done, so draining in order is enough
+        for stage in self.stages:
+            stage.join()
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,263 @@
+"""
+Sir Peepius Rate Limits
+Keeps outbound traffic just under the providers' ceilings instead of
+running into them:
+
+- OpenAILimiter: token buckets for requests/min and tokens/min, shared by
+  every thread in the process. The rates follow OpenAI's x-ratelimit-*
+  headers, are halved on a 429 and creep back up on success.
+- DailyQuota: Gmail's sends-per-day cap, counted in a small SQLite file so
+  it survives restarts and is shared between processes.
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from reply_parser import estimate_tokens
+
+DEFAULT_QUOTA_FILE = os.path.join(tempfile.gettempdir(), "sir_peepius_quota.db")
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """OpenAI reset durations like "1s", "6m0s" or "120ms" in seconds."""
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in _DURATION_RE.findall(value or ""))
+
+
+class TokenBucket:
+    """Classic token bucket; acquire() blocks (up to timeout) until enough tokens have accrued."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate          # Tokens per second
+        self.capacity = capacity
+        self.level = capacity
+        self._paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1, timeout=None):
+        """Take `amount` tokens; False if that isn't possible within timeout seconds."""
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                needed = min(amount, self.capacity)  # A request bigger than the bucket waits for a full one
+                if now >= self._paused_until and self.level >= needed:
+                    self.level -= amount
+                    return True
+                wait = max(self._paused_until - now, (needed - self.level) / self.rate if self.rate else 1.0)
+            if give_up_at is not None and time.monotonic() + wait > give_up_at:
+                return False
+            time.sleep(min(wait, 1.0))
+
+    def adjust(self, amount):
+        """Give back (positive) or charge extra (negative) tokens after the fact."""
+        with self._lock:
+            self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, remaining, rate=None):
+        """Never believe we have more than the server says is left."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate is not None:
+                self.rate = rate
+                self.capacity = max(rate * 10, 1)
+            self.level = min(self.level, remaining)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.level = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class OpenAILimiter:
+    """Shared requests/min and tokens/min budgets, adapted from headers and 429s."""
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=30000, completion_tokens=400):
+        self.ceilings = {"requests": requests_per_minute / 60, "tokens": tokens_per_minute / 60}
+        self.requests = TokenBucket(self.ceilings["requests"], max(self.ceilings["requests"] * 10, 1))
+        self.tokens = TokenBucket(self.ceilings["tokens"], max(self.ceilings["tokens"] * 10, 1))
+        self.completion_tokens = completion_tokens  # Expected reply size, charged up front
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+        self.throttled = 0
+
+    def acquire(self, prompt_tokens, timeout=None):
+        """Reserve one request and its estimated tokens. Returns the tokens charged (False on timeout)."""
+        charge = prompt_tokens + self.completion_tokens
+        start = time.monotonic()
+        ok = self.requests.acquire(1, timeout) and self.tokens.acquire(
+            charge, None if timeout is None else max(timeout - (time.monotonic() - start), 0))
+        with self._lock:
+            self.waited_seconds += time.monotonic() - start
+        return charge if ok else False
+
+    def update(self, headers, charged=None, used=None):
+        """Follow x-ratelimit-* response headers; recover 5% of the ceiling per success."""
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if limit and limit.isdigit():
+                self.ceilings[kind] = int(limit) / 60
+            rate = min(self.ceilings[kind], bucket.rate + 0.05 * self.ceilings[kind])
+            bucket.sync(int(remaining) if remaining and remaining.isdigit() else bucket.capacity, rate)
+        if charged is not None and used is not None:
+            self.tokens.adjust(charged - used)
+
+    def on_rate_limited(self, headers=None):
+        """A 429: halve both rates and pause until the server's reset time."""
+        headers = headers or {}
+        wait = max(parse_duration(headers.get("x-ratelimit-reset-requests")),
+                   parse_duration(headers.get("x-ratelimit-reset-tokens")))
+        try:
+            wait = max(wait, float(headers.get("retry-after") or 0))
+        except ValueError:
+            pass
+        for bucket in (self.requests, self.tokens):
+            bucket.sync(0, max(bucket.rate / 2, 0.01))
+            bucket.pause(wait or 1.0)
+        with self._lock:
+            self.throttled += 1
+        print(f"🐢 OpenAI rate limit hit; slowing down for {wait or 1.0:.1f}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests_per_minute": round(self.requests.rate * 60, 1),
+                "tokens_per_minute": round(self.tokens.rate * 60),
+                "throttled": self.throttled,
+                "waited_seconds": round(self.waited_seconds, 2),
+            }
+
+
+def _headers_of(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None) or {}
+
+
+def chat_completion(client, limiter, timeout, **kwargs):
+    """One chat completion under the shared limiter, learning from its rate-limit headers."""
+    prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in kwargs.get("messages", []))
+    start = time.monotonic()
+    charged = limiter.acquire(prompt_tokens, timeout)
+    if charged is False:
+        raise TimeoutError("rate limit wait would overrun the completion deadline")
+    remaining = timeout - (time.monotonic() - start)
+    try:
+        raw = client.with_options(timeout=remaining, max_retries=0).chat.completions.with_raw_response.create(**kwargs)
+    except Exception as e:
+        if getattr(e, "status_code", None) == 429:
+            limiter.on_rate_limited(_headers_of(e))
+        raise
+    completion = raw.parse()
+    usage = getattr(completion, "usage", None)
+    limiter.update(raw.headers, charged, getattr(usage, "total_tokens", None))
+    return completion
+
+
+class DailyQuota:
+    """Sends per UTC day, counted in SQLite; acquire() waits for tomorrow once the cap is reached."""
+
+    def __init__(self, limit, path=DEFAULT_QUOTA_FILE, name="smtp"):
+        self.limit = limit
+        self.path = path
+        self.name = name
+        self.waited_seconds = 0.0
+        db = sqlite3.connect(path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS quota ("
+            " name TEXT NOT NULL,"
+            " day TEXT NOT NULL,"
+            " used INTEGER NOT NULL,"
+            " PRIMARY KEY (name, day))"
+        )
+        db.commit()
+        db.close()
+
+    @staticmethod
+    def _today():
+        return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+    @staticmethod
+    def _seconds_to_midnight():
+        now = datetime.datetime.now(datetime.timezone.utc)
+        tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(),
+                                             tzinfo=datetime.timezone.utc)
+        return (tomorrow - now).total_seconds()
+
+    def _take(self, set_used=None):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            day = self._today()
+            row = db.execute("SELECT used FROM quota WHERE name = ? AND day = ?", (self.name, day)).fetchone()
+            used = row[0] if row else 0
+            if set_used is not None:
+                used, ok = set_used, False
+            elif used < self.limit:
+                used, ok = used + 1, True
+            else:
+                ok = False
+            db.execute("INSERT OR REPLACE INTO quota VALUES (?, ?, ?)", (self.name, day, used))
+            db.execute("DELETE FROM quota WHERE name = ? AND day != ?", (self.name, day))
+            db.execute("COMMIT")
+            return ok
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def acquire(self):
+        """Count one send, first waiting for the next UTC day if today's cap is used up."""
+        announced = False
+        while not self._take():
+            wait = self._seconds_to_midnight()
+            if not announced:
+                print(f"🐢 Daily {self.name} cap of {self.limit} reached; holding sends for {wait / 3600:.1f}h")
+                announced = True
+            time.sleep(min(wait + 1, 300))
+            self.waited_seconds += min(wait + 1, 300)
+
+    def exhaust(self):
+        """The server said the cap is reached (whatever our count says): stop for today."""
+        self._take(set_used=self.limit)
+
+    def used(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            row = db.execute("SELECT used FROM quota WHERE name = ? AND day = ?", (self.name, self._today())).fetchone()
+        finally:
+            db.close()
+        return row[0] if row else 0
+
+    def stats(self):
+        return {"limit": self.limit, "used_today": self.used(), "waited_seconds": round(self.waited_seconds)}
+
+
+_openai_limiter = None
+_openai_limiter_lock = threading.Lock()
+
+
+def get_openai_limiter():
+    """The process-wide OpenAI limiter (OPENAI_RPM / OPENAI_TPM), shared by all worker threads."""
+    global _openai_limiter
+    with _openai_limiter_lock:
+        if _openai_limiter is None:
+            _openai_limiter = OpenAILimiter(
+                requests_per_minute=int(os.getenv("OPENAI_RPM", "500")),
+                tokens_per_minute=int(os.getenv("OPENAI_TPM", "30000")),
+            )
+        return _openai_limiter
@@ -0,0 +1,133 @@
+"""
+Sir Peepius Reply Cache
+Content-addressed cache of generated replies, keyed by a hash of (model,
+system prompt, normalized body, conversation context). Automated notices,
+repeated pings and redelivered notifications reuse the earlier reply
+instead of paying for another completion.
+
+Two tiers: an in-process LRU dict, and optionally a SQLite file that
+survives restarts and is shared by processes on the same machine. Both
+evict by age (TTL) and size.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_body(text):
+    """Collapse whitespace so re-wrapped copies of the same text share a key."""
+    return _WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+def make_key(model, system_prompt, body, context=None):
+    """sha256 over everything that decides what the model would answer."""
+    payload = json.dumps([model, system_prompt, normalize_body(body), context or []],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ReplyCache:
+    """get_or_create(key, produce) returns a cached reply or calls produce() and stores it."""
+
+    def __init__(self, max_entries=256, ttl=3600, path=None, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, reply, produce_seconds)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS replies ("
+                " key TEXT PRIMARY KEY,"
+                " reply TEXT NOT NULL,"
+                " produce_seconds REAL NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS replies_expiry ON replies (expires_at)")
+            self._db.commit()
+
+    def _remember(self, key, expires_at, reply, seconds):
+        self._entries[key] = (expires_at, reply, seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached reply for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    self.seconds_saved += entry[2]
+                    return entry[1]
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT reply, produce_seconds, expires_at FROM replies WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row:
+                    reply, seconds, expires_at = row
+                    self._remember(key, expires_at, reply, seconds)
+                    self.disk_hits += 1
+                    self.seconds_saved += seconds
+                    return reply
+            self.misses += 1
+            return None
+
+    def put(self, key, reply, produce_seconds=0.0):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, reply, produce_seconds)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO replies VALUES (?, ?, ?, ?)",
+                                 (key, reply, produce_seconds, expires_at))
+                self._db.execute("DELETE FROM replies WHERE expires_at <= ?", (time.time(),))
+                self._db.execute(
+                    "DELETE FROM replies WHERE key IN (SELECT key FROM replies"
+                    " ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+                self._db.commit()
+
+    def get_or_create(self, key, produce):
+        """Cached reply for key, or produce() timed and stored. Exceptions are not cached."""
+        reply = self.get(key)
+        if reply is not None:
+            print("♻️ Reusing a cached reply")
+            return reply
+        start = time.monotonic()
+        reply = produce()
+        self.put(key, reply, time.monotonic() - start)
+        return reply
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "seconds_saved": round(self.seconds_saved, 3),
+            }
@@ -0,0 +1,73 @@
+"""
+Sir Peepius Reply Generator
+Everything between an email's text and Sir Peepius' reply, shared by every
+bot script: the reply cache, fast/strong model routing, hedged and
+deadline-bound completions and the process-wide OpenAI rate limiter, all
+configured from the environment.
+"""
+
+import os
+
+from openai_client import get_openai_client
+from reply_cache import ReplyCache, make_key
+from model_router import ModelRouter
+from completion_executor import CompletionExecutor
+from rate_limit import chat_completion, get_openai_limiter
+
+
+class ReplyGenerator:
+    """generate() answers one email; complete() runs any single chat completion under the same limits."""
+
+    def __init__(self, api_key, system_prompt, strong_default):
+        self.api_key = api_key
+        self.system_prompt = system_prompt
+        # Identical bodies (automated notices, repeat pings, redeliveries) reuse the earlier reply
+        self.cache = ReplyCache(
+            max_entries=int(os.getenv("REPLY_CACHE_SIZE", "256")),
+            ttl=float(os.getenv("REPLY_CACHE_TTL", "3600")),
+            path=os.getenv("REPLY_CACHE_FILE") or None,
+        )
+        # Short, simple mail goes to FAST_MODEL; long or question-heavy mail to STRONG_MODEL
+        self.router = ModelRouter.from_env(strong_default=strong_default)
+        # Deadline-bounded completions: hedged past p95, 429/5xx retried with jittered backoff
+        self.completions = CompletionExecutor(
+            deadline=float(os.getenv("COMPLETION_DEADLINE", "45")),
+            hedge=os.getenv("COMPLETION_HEDGE", "1") != "0",
+        )
+        # Requests/min and tokens/min buckets shared by every worker thread (OPENAI_RPM / OPENAI_TPM)
+        self.limiter = get_openai_limiter()
+
+    def messages(self, text, history=()):
+        """Chat messages for one email: system prompt, earlier turns, then the email itself."""
+        return [{"role": "system", "content": self.system_prompt}] + list(history) + [
+            {"role": "user", "content": text}
+        ]
+
+    def complete(self, model, messages):
+        """One deadline-bound, rate-limited completion; returns the reply text."""
+        client = get_openai_client(self.api_key)
+        response = self.completions.run(lambda timeout: chat_completion(
+            client, self.limiter, timeout, model=model, messages=messages))
+        return response.choices[0].message.content.strip()
+
+    def generate(self, text, subject="", history=None):
+        """Reply to one email (history: earlier turns as chat messages), from the cache when possible."""
+        tier, model = self.router.route(text, subject)
+
+        def ask_openai():
+            with self.router.timing(tier):
+                return self.complete(model, self.messages(text, history or ()))
+        return self.cache.get_or_create(make_key(model, self.system_prompt, text, history), ask_openai)
+
+    def stats(self):
+        return {
+            "reply_cache": self.cache.stats(),
+            "models": self.router.stats(),
+            "completions": self.completions.stats(),
+            "rate_limits": self.limiter.stats(),
+        }
+
+
+def make_reply_generator(api_key, system_prompt, strong_default):
+    """Build a script's reply generator; strong_default is its STRONG_MODEL unless the environment says otherwise."""
+    return ReplyGenerator(api_key, system_prompt, strong_default)
@@ -0,0 +1,72 @@
+"""
+Sir Peepius Reply Parser
+Strips quoted history, "On … wrote:" blocks, forwarded headers, signatures
+and disclaimers from an incoming email, so OpenAI only sees what the sender
+actually wrote this time.
+"""
+
+import re
+
+# Everything from one of these lines down is earlier mail, not the new message
+_CUT_RES = [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in (
+    r"^\s*On\b.{0,200}\bwrote:\s*$",                  # Gmail / Apple Mail
+    r"^\s*Le\b.{0,200}\ba écrit\s*:\s*$",
+    r"^\s*Am\b.{0,200}\bschrieb\b.{0,100}:\s*$",
+    r"^\s*-{2,}\s*Original Message\s*-{2,}\s*$",       # Outlook
+    r"^\s*-{2,}\s*Forwarded message\s*-{2,}\s*$",      # Gmail forwards
+    r"^\s*Begin forwarded message:\s*$",               # Apple Mail forwards
+    r"^\s*_{10,}\s*$",                                 # Outlook separator
+    r"^\s*From:\s.+\n\s*(Sent|Date):\s",               # Outlook header block
+)]
+# Signatures and footers: everything from here down is dropped too
+_SIGNATURE_RES = [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in (
+    r"^--\s*$",
+    r"^\s*Sent from my \w+",
+    r"^\s*Get Outlook for \w+",
+    r"^\s*(CONFIDENTIALITY|DISCLAIMER|PRIVILEGED)\b.*(NOTICE|:)",
+    r"^\s*This (e-?mail|message)( and any attachments)? (is|are|may be) (confidential|intended)",
+)]
+_QUOTED_LINE_RE = re.compile(r"^[ \t]*>.*\n?", re.MULTILINE)
+_WRAPPED_WROTE_RE = re.compile(r"^(\s*On\b[^\n]{0,200})\n([^\n]{0,200}\bwrote:\s*)$", re.IGNORECASE | re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+
+def estimate_tokens(text):
+    """Rough OpenAI token count (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def _earliest_cut(text, patterns):
+    cut = len(text)
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match and match.start() < cut:
+            cut = match.start()
+    return cut
+
+
+def strip_reply(text):
+    """
+    Return (new_text, tokens_removed). Falls back to the original text if
+    stripping would leave nothing (e.g. a bare forward).
+    """
+    if not text:
+        return text, 0
+    cleaned = text.replace("\r\n", "\n")
+    # Some clients wrap "On <date>, <name>\n<address> wrote:" over two lines
+    cleaned = _WRAPPED_WROTE_RE.sub(r"\1 \2", cleaned)
+    cleaned = cleaned[:_earliest_cut(cleaned, _CUT_RES)]
+    cleaned = _QUOTED_LINE_RE.sub("", cleaned)
+    cleaned = cleaned[:_earliest_cut(cleaned, _SIGNATURE_RES)]
+    cleaned = _BLANK_LINES_RE.sub("\n\n", cleaned).strip()
+    if not cleaned:
+        return text, 0
+    return cleaned, max(estimate_tokens(text) - estimate_tokens(cleaned), 0)
+
+
+def clean_reply_text(text):
+    """strip_reply() plus a log line saying how many tokens it saved."""
+    cleaned, removed = strip_reply(text)
+    if removed:
+        print(f"✂️ Trimmed {removed} of {estimate_tokens(text)} tokens of quoted history/signature")
+    return cleaned
@@ -0,0 +1,167 @@
+"""
+Sir Peepius SMTP Sender
+Keeps one authenticated SMTP session warm and drains queued replies over
+it, instead of paying TLS + AUTH for every single email.
+"""
+
+import collections
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+
+from rate_limit import DEFAULT_QUOTA_FILE, DailyQuota
+
+# Errors that mean the session is gone and a fresh login might succeed
+DISCONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, ssl.SSLError)
+
+
+class SMTPSender:
+    """A warm SMTP_SSL session plus an outbound queue drained by a background worker."""
+
+    def __init__(self, server, port, user, password, probe_after=10, timeout=30, quota=None):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.probe_after = probe_after  # Seconds idle before we NOOP-probe the session
+        self.timeout = timeout
+        self.quota = quota  # Optional DailyQuota; send() waits on it before each message
+        self._smtp = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.connects = 0
+        self._latencies = collections.deque(maxlen=200)
+
+    def _connect(self):
+        self._close()
+        smtp = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+        smtp.login(self.user, self.password)
+        self._smtp = smtp
+        self.connects += 1
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _session(self):
+        """Return a live session, probing with NOOP if it has been idle for a while."""
+        if self._smtp is None:
+            self._connect()
+        elif time.monotonic() - self._last_used > self.probe_after:
+            try:
+                code, _ = self._smtp.noop()
+            except DISCONNECT_ERRORS:
+                code = None
+            if code != 250:
+                self._connect()
+        return self._smtp
+
+    @staticmethod
+    def _is_quota_error(error):
+        """Gmail's "550 5.4.5 Daily user sending limit exceeded" (or similar) rejection."""
+        text = str(getattr(error, "smtp_error", b"") or error)
+        return isinstance(error, smtplib.SMTPResponseException) and (
+            "5.4.5" in text or "quota" in text.lower() or "sending limit" in text.lower())
+
+    def send(self, msg):
+        """Send one message over the warm session, reconnecting once if the server hung up."""
+        if self.quota is not None:
+            self.quota.acquire()
+        with self._lock:
+            start = time.monotonic()
+            try:
+                try:
+                    self._session().send_message(msg)
+                except DISCONNECT_ERRORS:
+                    self._connect()
+                    self._smtp.send_message(msg)
+            except Exception as e:
+                self.failed += 1
+                if self.quota is not None and self._is_quota_error(e):
+                    self.quota.exhaust()
+                raise
+            self._last_used = time.monotonic()
+            self._latencies.append(self._last_used - start)
+            self.sent += 1
+
+    def enqueue(self, msg, on_sent=None):
+        """Queue a message for the background worker and return immediately; on_sent() runs once it's out."""
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._drain, daemon=True)
+                self._worker.start()
+        self._queue.put((msg, on_sent))
+
+    def _drain(self):
+        while True:
+            msg, on_sent = self._queue.get()
+            sent = False
+            try:
+                self.send(msg)
+                sent = True
+                print(f"📨 Replied to {msg['To']}!")
+                if on_sent is not None:
+                    on_sent()
+            except Exception as e:
+                if sent:
+                    print(f"⚠️ Replied to {msg['To']} but the follow-up failed: {e}")
+                else:
+                    print(f"⚠️ Could not send email to {msg['To']}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued message has been sent (or has failed)."""
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "connects": self.connects,
+            "avg_send_ms": round(1000 * sum(latencies) / len(latencies), 1) if latencies else None,
+            "p95_send_ms": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1) if latencies else None,
+            "daily_quota": self.quota.stats() if self.quota is not None else None,
+        }
+
+
+# Senders live at module level so warm Cloud Function instances keep their session
+_senders = {}
+_senders_lock = threading.Lock()
+
+
+def get_sender(server, port, user, password, **kwargs):
+    """
+    Return the shared sender for this account, creating it on first use.
+    Sends are capped at SMTP_DAILY_LIMIT per UTC day (default 500, Gmail's
+    limit; 0 disables the cap).
+    """
+    key = (server, port, user)
+    with _senders_lock:
+        sender = _senders.get(key)
+        if sender is None:
+            daily_limit = int(os.getenv("SMTP_DAILY_LIMIT", "500"))
+            if daily_limit > 0 and "quota" not in kwargs:
+                kwargs["quota"] = DailyQuota(daily_limit, os.getenv("SMTP_QUOTA_FILE", DEFAULT_QUOTA_FILE),
+                                             name=f"smtp:{user}")
+            sender = SMTPSender(server, port, user, password, **kwargs)
+            _senders[key] = sender
+        return sender
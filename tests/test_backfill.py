@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+
+import pytest
+
+import backfill
+from backfill import Backfill, BackfillCheckpoint, BatchFailed, LocalBatchClient
+
+BACKLOG = list(range(1, 13))
+
+
+class FakeMailbox:
+    """UNSEEN search and \\Seen stores; everything else is patched out below."""
+
+    uidvalidity = 42
+
+    def __init__(self):
+        self.searches = 0
+        self.seen = []
+
+    def uid(self, command, *args):
+        if command == "SEARCH":
+            self.searches += 1
+            return "OK", [b" ".join(b"%d" % uid for uid in BACKLOG)]
+        self.seen.append(args[0])
+        return "OK", [b""]
+
+
+class FakePool:
+    def __init__(self):
+        self.mailbox = FakeMailbox()
+
+    @contextmanager
+    def session(self):
+        yield self.mailbox
+
+
+@pytest.fixture(autouse=True)
+def fake_fetch(monkeypatch):
+    def fetch_headers(conn, uids):
+        return [{
+            "id": b"%d" % int(uid),
+            "from": "spam@y.com" if int(uid) % 4 == 0 else f"friend{int(uid)}@x.com",
+            "subject": f"note {int(uid)}",
+            "message_id": f"<{int(uid)}@x.com>",
+        } for uid in uids]
+
+    def iter_text_bodies(conn, headers):
+        for h in headers:
+            yield h["id"], b"Subject: " + h["subject"].encode() + b"\r\n\r\nhello " + h["id"]
+
+    monkeypatch.setattr(backfill, "fetch_headers", fetch_headers)
+    monkeypatch.setattr(backfill, "iter_text_bodies", iter_text_bodies)
+
+
+def wanted(headers):
+    return not headers["from"].startswith("spam"), headers["from"]
+
+
+def build_request(text, subject):
+    return {"model": "test", "messages": [{"role": "user", "content": text}]}
+
+
+def make_backfill(pool, path, batches, send_reply, **kwargs):
+    return Backfill(pool, BackfillCheckpoint(path), batches, wanted, build_request, send_reply,
+                    batch_size=4, max_in_flight=2, poll_interval=0.01, **kwargs)
+
+
+def reply(body):
+    return "Huzzah! " + body["messages"][0]["content"]
+
+
+def test_resume_after_crash_sends_each_reply_at_most_once(tmp_path):
+    path = str(tmp_path / "backfill.db")
+    pool = FakePool()
+    sent = []
+
+    def crash_on_fourth(to_addr, subject, message_id, text):
+        if len(sent) == 3:
+            raise KeyboardInterrupt("power cut")
+        sent.append(subject)
+
+    with pytest.raises(KeyboardInterrupt):
+        make_backfill(pool, path, LocalBatchClient(reply, workers=2), crash_on_fourth).run()
+    assert len(sent) == 3
+
+    def send(to_addr, subject, message_id, text):
+        sent.append(subject)
+
+    counts = make_backfill(pool, path, LocalBatchClient(reply, workers=2), send).run()
+
+    targets = [uid for uid in BACKLOG if uid % 4]
+    assert pool.mailbox.searches == 1  # The second run resumed the first run's snapshot
+    assert counts == {"replied": len(targets) - 1, "failed": 1}
+    assert len(sent) == len(set(sent)) == len(targets) - 1
+    assert len(pool.mailbox.seen) == len(targets) - 1
+
+
+def test_finished_run_takes_a_fresh_snapshot(tmp_path):
+    path = str(tmp_path / "backfill.db")
+    pool = FakePool()
+    make_backfill(pool, path, LocalBatchClient(reply), lambda *args: None).run()
+    make_backfill(pool, path, LocalBatchClient(reply), lambda *args: None).run()
+    assert pool.mailbox.searches == 2
+
+
+def test_failed_batches_stop_after_max_attempts(tmp_path):
+    class AlwaysFails:
+        submits = 0
+
+        def submit(self, requests):
+            self.submits += 1
+            return f"batch-{self.submits}"
+
+        def collect(self, batch_id):
+            raise BatchFailed(f"{batch_id} failed")
+
+    batches = AlwaysFails()
+    counts = make_backfill(FakePool(), str(tmp_path / "backfill.db"), batches, lambda *args: None,
+                           max_attempts=3).run()
+    assert counts == {"failed": len([uid for uid in BACKLOG if uid % 4])}
+    assert batches.submits == 3 * 3  # Three batches of up to four, each tried three times
+
+
+def test_checkpoint_recover_fails_interrupted_sends(tmp_path):
+    checkpoint = BackfillCheckpoint(str(tmp_path / "backfill.db"))
+    checkpoint.start(42, [(1, "a@x.com", "hi", "<1@x>"), (2, "b@x.com", "yo", "<2@x>")])
+    checkpoint.mark(1, "sending")
+    assert checkpoint.recover() == 1
+    assert checkpoint.message(1)["state"] == "failed"
+    assert checkpoint.pending(10) == [2]
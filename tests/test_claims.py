@@ -0,0 +1,161 @@
+import re
+import time
+
+from claims import CLAIM_KEYWORD, ImapKeywordClaims, LeaseTableClaims
+from imap_fetch import compress_uid_set
+
+
+class FakeCondstoreServer:
+    """A mailbox shared by several connections: per-UID flags and MODSEQs, with UNCHANGEDSINCE checks."""
+
+    def __init__(self, uids):
+        self.modseq = 100
+        self.messages = {uid: {"modseq": self.modseq, "flags": set()} for uid in uids}
+        self.stores = 0
+
+    def touch(self, uid, *flags):
+        self.modseq += 1
+        self.messages[uid]["modseq"] = self.modseq
+        self.messages[uid]["flags"].update(flags)
+
+
+class FakeConn:
+    """uid("FETCH"/"STORE") and response("MODIFIED") the way imaplib returns them."""
+
+    def __init__(self, server, before_store=None):
+        self.server = server
+        self.before_store = before_store
+        self.modified = []
+
+    def _uids(self, uid_set):
+        uids = set()
+        for part in uid_set.split(","):
+            low, _, high = part.partition(":")
+            uids.update(range(int(low), int(high or low) + 1))
+        return sorted(uid for uid in uids if uid in self.server.messages)
+
+    def uid(self, command, uid_set, *args):
+        if command == "FETCH":
+            return "OK", [
+                b"%d (UID %d MODSEQ (%d) FLAGS (%s))" % (n, uid, m["modseq"], " ".join(sorted(m["flags"])).encode())
+                for n, (uid, m) in enumerate((u, self.server.messages[u]) for u in self._uids(uid_set))
+            ]
+        if self.before_store:
+            self.before_store()
+        self.server.stores += 1
+        unchanged_since, action = re.match(r"\(UNCHANGEDSINCE (\d+)\) (\S+)", args[0]).groups()
+        flags = set(args[1].strip("()").split())
+        failed = []
+        for uid in self._uids(uid_set):
+            message = self.server.messages[uid]
+            if message["modseq"] > int(unchanged_since):
+                failed.append(uid)
+                continue
+            if action == "+FLAGS.SILENT":
+                message["flags"] |= flags
+            else:
+                message["flags"] = set(flags)
+            self.server.modseq += 1
+            message["modseq"] = self.server.modseq
+        if failed:
+            self.modified.append(compress_uid_set(failed).encode())
+        return "OK", [b"STORE completed"]
+
+    def response(self, code):
+        data, self.modified = self.modified or [None], []
+        return code, data
+
+
+def claim_flags(server, uid):
+    return [flag for flag in server.messages[uid]["flags"] if flag.startswith(CLAIM_KEYWORD)]
+
+
+def test_batch_claim_is_one_store():
+    server = FakeCondstoreServer([1, 2, 3, 5])
+    claims = ImapKeywordClaims()
+
+    assert claims.claim(FakeConn(server), [b"1", b"2", b"3", b"5"]) == [b"1", b"2", b"3", b"5"]
+    assert server.stores == 1
+    assert all(len(claim_flags(server, uid)) == 1 for uid in (1, 2, 3, 5))
+
+
+def test_message_claimed_elsewhere_is_lost():
+    server = FakeCondstoreServer([1, 2])
+    assert ImapKeywordClaims().claim(FakeConn(server), [b"2"]) == [b"2"]
+
+    claims = ImapKeywordClaims()
+    assert claims.claim(FakeConn(server), [b"1", b"2"]) == [b"1"]
+    assert claims.stats() == {"backend": "imap", "won": 1, "lost": 1, "deferred": 0, "taken_over": 0}
+
+
+def test_claim_lost_to_a_racing_instance():
+    server = FakeCondstoreServer([1, 2, 3])
+    other = ImapKeywordClaims()
+    # Another instance claims UID 2 between this instance's FETCH and its STORE
+    conn = FakeConn(server, before_store=lambda: other.claim(FakeConn(server), [b"2"]))
+
+    claims = ImapKeywordClaims()
+    assert claims.claim(conn, [b"1", b"2", b"3"]) == [b"1", b"3"]
+    assert claims.lost == 1
+    assert len(claim_flags(server, 2)) == 1
+
+
+def test_stale_claim_is_taken_over_keeping_other_flags():
+    server = FakeCondstoreServer([7])
+    server.touch(7, f"{CLAIM_KEYWORD}_{int(time.time()) - 3600}", "\\Flagged", "\\Recent")
+
+    claims = ImapKeywordClaims(ttl=600)
+    assert claims.claim(FakeConn(server), [b"7"]) == [b"7"]
+    assert claims.taken_over == 1
+    [flag] = claim_flags(server, 7)
+    assert int(flag.rsplit("_", 1)[1]) >= int(time.time()) - 5
+    assert "\\Flagged" in server.messages[7]["flags"] and "\\Recent" not in server.messages[7]["flags"]
+
+
+def test_fresh_claim_is_not_taken_over():
+    server = FakeCondstoreServer([7])
+    server.touch(7, f"{CLAIM_KEYWORD}_{int(time.time()) - 60}")
+    assert ImapKeywordClaims(ttl=600).claim(FakeConn(server), [b"7"]) == []
+
+
+def test_instances_split_a_backlog_in_batches():
+    backlog = list(range(1, 26))
+    server = FakeCondstoreServer(backlog)
+    uids = [b"%d" % uid for uid in backlog]
+    first, second = ImapKeywordClaims(batch=10), ImapKeywordClaims(batch=10)
+
+    mine = first.claim(FakeConn(server), uids)
+    theirs = second.claim(FakeConn(server), uids)
+
+    assert len(mine) == len(theirs) == 10 and not set(mine) & set(theirs)
+    assert first.stats()["deferred"] == 15
+    assert second.stats()["lost"] == 10 and second.stats()["deferred"] == 5
+    rest = first.claim(FakeConn(server), uids)
+    assert sorted(mine + theirs + rest) == sorted(uids)
+
+
+def test_lease_table_second_owner_loses(tmp_path):
+    path = str(tmp_path / "leases.db")
+    first = LeaseTableClaims(path, owner="a")
+    second = LeaseTableClaims(path, owner="b")
+
+    assert sorted(first.claim(None, [b"1", b"2"])) == [b"1", b"2"]
+    assert sorted(second.claim(None, [b"2", b"3"])) == [b"3"]
+    assert second.stats()["lost"] == 1
+
+
+def test_expired_lease_can_be_taken_over(tmp_path):
+    path = str(tmp_path / "leases.db")
+    assert LeaseTableClaims(path, ttl=-1, owner="a").claim(None, [b"1"]) == [b"1"]
+    assert LeaseTableClaims(path, owner="b").claim(None, [b"1"]) == [b"1"]
+
+
+def test_lease_table_claims_at_most_a_batch(tmp_path):
+    path = str(tmp_path / "leases.db")
+    uids = [b"%d" % uid for uid in range(1, 8)]
+    first = LeaseTableClaims(path, owner="a", batch=3)
+    second = LeaseTableClaims(path, owner="b", batch=3)
+
+    mine, theirs = first.claim(None, uids), second.claim(None, uids)
+    assert len(mine) == len(theirs) == 3 and not set(mine) & set(theirs)
+    assert first.stats()["deferred"] == 4
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from coalesce import NotificationCoalescer
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_burst_is_one_sync_with_the_highest_history_id():
+    calls = []
+    coalescer = NotificationCoalescer(lambda history_id: calls.append(history_id), window=0.05)
+
+    for history_id in (7, "12", 9):
+        assert coalescer.notify(history_id) is None
+
+    wait_until(lambda: not coalescer.stats()["running"])
+    assert calls == [12]
+    assert coalescer.stats()["received"] == 3 and coalescer.stats()["coalesced"] == 2
+
+
+def test_notifications_during_a_sync_share_one_follow_up():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def sync(history_id):
+        calls.append(history_id)
+        if len(calls) == 1:
+            started.set()
+            release.wait(2)
+        return f"synced {history_id}"
+
+    coalescer = NotificationCoalescer(sync, window=0)
+    coalescer.notify(1)
+    started.wait(2)
+
+    results = []
+    waiters = [threading.Thread(target=lambda h=h: results.append(coalescer.notify(h, wait=True)))
+               for h in (2, 3, 4)]
+    for waiter in waiters:
+        waiter.start()
+    wait_until(lambda: coalescer.stats()["received"] == 4)
+    release.set()
+    for waiter in waiters:
+        waiter.join(2)
+
+    assert calls == [1, 4]
+    assert results == ["synced 4"] * 3
+    assert coalescer.stats()["syncs"] == 2
+
+
+def test_failed_sync_is_reported_to_the_waiter():
+    def sync(history_id):
+        raise RuntimeError("IMAP down")
+
+    coalescer = NotificationCoalescer(sync, window=0)
+    assert coalescer.notify(5, wait=True) == ("Error: IMAP down", 500)
+    assert not coalescer.stats()["running"]
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from completion_executor import CompletionExecutor, DeadlineExceeded, is_retryable
+
+
+class APIError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.headers = {"retry-after": retry_after} if retry_after is not None else {}
+
+
+def failing(*errors, result="Ahoy!"):
+    """A call that raises the given errors in turn, then returns result."""
+    errors = list(errors)
+    timeouts = []
+
+    def call(timeout):
+        timeouts.append(timeout)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    call.timeouts = timeouts
+    return call
+
+
+def test_retryable_errors():
+    assert is_retryable(APIError(429)) and is_retryable(APIError(503))
+    assert is_retryable(TimeoutError()) and is_retryable(ConnectionResetError())
+    assert not is_retryable(APIError(400)) and not is_retryable(ValueError())
+
+
+def test_rate_limit_and_server_errors_are_retried():
+    executor = CompletionExecutor(deadline=5, hedge=False, base_delay=0.01)
+    call = failing(APIError(429), APIError(502))
+
+    assert executor.run(call) == "Ahoy!"
+    assert len(call.timeouts) == 3 and all(0 < t <= 5 for t in call.timeouts)
+    assert executor.stats()["retries"] == 2
+
+
+def test_client_error_is_not_retried():
+    executor = CompletionExecutor(deadline=5, hedge=False, base_delay=0.01)
+    call = failing(APIError(400))
+
+    with pytest.raises(APIError):
+        executor.run(call)
+    assert len(call.timeouts) == 1 and executor.retries == 0
+
+
+def test_retries_stop_after_max_retries():
+    executor = CompletionExecutor(deadline=5, hedge=False, max_retries=2, base_delay=0.01)
+    with pytest.raises(APIError):
+        executor.run(failing(*[APIError(500)] * 5))
+    assert executor.retries == 2
+
+
+def test_retry_after_past_the_deadline_gives_up_at_once():
+    executor = CompletionExecutor(deadline=0.5, hedge=False)
+    start = time.monotonic()
+
+    with pytest.raises(DeadlineExceeded):
+        executor.run(failing(APIError(429, retry_after="30")))
+    assert time.monotonic() - start < 0.5
+    assert executor.stats()["deadline_misses"] == 1
+
+
+def test_slow_call_misses_the_deadline():
+    executor = CompletionExecutor(deadline=0.1, hedge=False)
+    release = threading.Event()
+
+    with pytest.raises(DeadlineExceeded):
+        executor.run(lambda timeout: release.wait(2))
+    release.set()
+    assert executor.deadline_misses == 1
+
+
+def test_request_stalled_past_p95_is_hedged():
+    executor = CompletionExecutor(deadline=5, min_samples=3)
+    for _ in range(3):
+        executor.run(lambda timeout: "warm")
+
+    release = threading.Event()
+    calls = []
+
+    def call(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            release.wait(2)  # The primary stalls
+            return "primary"
+        return "hedge"
+
+    try:
+        assert executor.run(call) == "hedge"
+    finally:
+        release.set()
+    stats = executor.stats()
+    assert len(calls) == 2 and stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_no_hedging_before_enough_samples():
+    executor = CompletionExecutor(deadline=5, min_samples=20)
+    calls = []
+
+    def call(timeout):
+        calls.append(timeout)
+        time.sleep(0.05)
+        return "only"
+
+    assert executor.run(call) == "only"
+    assert len(calls) == 1 and executor.hedges == 0
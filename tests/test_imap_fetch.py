@@ -0,0 +1,184 @@
+import io
+
+import pytest
+
+import imap_fetch
+from imap_fetch import compress_uid_set, fetch_headers, fetch_matching, find_text_part, iter_uid_fetch
+
+
+class FakeConn:
+    """Just enough of imaplib.IMAP4 for iter_uid_fetch: send() a command, then read the canned reply."""
+
+    def __init__(self, *replies, status=b"OK FETCH completed"):
+        self.replies = list(replies)
+        self.status = status
+        self.sent = []
+        self.buf = io.BytesIO()
+        self.closed = False
+
+    def send(self, data):
+        self.sent.append(data)
+        tag = data.split()[0]
+        done = tag + b" " + self.status + b"\r\n" if self.status else b""  # None: connection drops
+        self.buf = io.BytesIO(self.replies.pop(0) + done)
+
+    def readline(self):
+        return self.buf.readline()
+
+    def read(self, n):
+        return self.buf.read(n)
+
+    def shutdown(self):
+        self.closed = True
+
+
+def literal(data):
+    return b"{%d}\r\n%s" % (len(data), data)
+
+
+def header_response(seq, uid, header, structure=b'("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 12 1)'):
+    return (b"* %d FETCH (UID %d RFC822.SIZE 900 BODYSTRUCTURE %s "
+            b"BODY[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)] %s)\r\n" % (seq, uid, structure, literal(header)))
+
+
+def test_compress_uid_set():
+    assert compress_uid_set([b"10", b"1", b"2", b"3", b"5", b"9", b"3"]) == "1:3,5,9:10"
+
+
+def test_multi_literal_responses_are_split_per_message():
+    a = b"From: a@x.com\r\nSubject: first\r\n\r\n"
+    b = b"From: b@x.com\r\nSubject: second\r\nMessage-ID: <2@x>\r\n\r\n"
+    # The second message's non-ASCII filename arrives as a literal inside BODYSTRUCTURE, before its header
+    structure = (b'(("text" "plain" ("charset" "iso-8859-1") NIL NIL "quoted-printable" 40 2 NIL NIL NIL)'
+                 b'("application" "pdf" ("name" ' + literal(b"r\xe9sum\xe9.pdf") + b') NIL NIL "base64" 5000 NIL'
+                 b' ("attachment" NIL) NIL) "mixed" NIL NIL NIL)')
+    conn = FakeConn(header_response(1, 5, a) + b"* 4 EXISTS\r\n" + header_response(2, 9, b, structure))
+
+    headers = fetch_headers(conn, [b"5", b"9"])
+
+    assert conn.sent[0].endswith(b"UID FETCH 5,9 " + imap_fetch.HEADER_ITEMS.encode() + b"\r\n")
+    assert [h["id"] for h in headers] == [b"5", b"9"]
+    assert headers[0]["subject"] == "first" and headers[0]["size"] == 900
+    assert headers[1]["from"] == "b@x.com" and headers[1]["message_id"] == "<2@x>"
+    assert headers[1]["raw_header"] == b
+    assert headers[1]["text_part"] == {
+        "section": "1", "subtype": "plain", "charset": "iso-8859-1", "encoding": "quoted-printable", "size": 40,
+    }
+
+
+def test_stopping_early_drains_the_rest_of_the_response():
+    conn = FakeConn(b"* 1 FETCH (UID 5 RFC822 " + literal(b"abc") + b")\r\n"
+                    b"* 2 FETCH (UID 6 RFC822 " + literal(b"def") + b")\r\n")
+    fetch = iter_uid_fetch(conn, [b"5", b"6"], imap_fetch.BODY_ITEMS)
+    assert next(fetch) == (b"5", b"* 1 FETCH (UID 5 RFC822 {#0})", [b"abc"])
+    fetch.close()
+    assert conn.buf.read() == b"" and not conn.closed
+
+
+def test_tagged_no_raises():
+    conn = FakeConn(b"", status=b"NO [UNAVAILABLE] try later")
+    with pytest.raises(imap_fetch.imaplib.IMAP4.error):
+        list(iter_uid_fetch(conn, [b"1"], imap_fetch.BODY_ITEMS))
+
+
+def test_connection_closed_mid_literal_aborts():
+    conn = FakeConn(b"* 1 FETCH (UID 5 RFC822 {30}\r\nshort", status=None)
+    with pytest.raises(imap_fetch.imaplib.IMAP4.abort):
+        list(iter_uid_fetch(conn, [b"5"], imap_fetch.BODY_ITEMS))
+
+
+def text_part(structure, literals=()):
+    return find_text_part(b"* 1 FETCH (UID 1 BODYSTRUCTURE " + structure + b")", list(literals))
+
+
+PLAIN = b'("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 120 4 NIL ("inline" NIL) NIL)'
+HTML = b'("text" "html" ("charset" "windows-1252") NIL NIL "quoted-printable" 800 20 NIL NIL NIL)'
+PDF = b'("application" "pdf" ("name" "a.pdf") NIL NIL "base64" 50000 NIL ("attachment" ("filename" "a.pdf")) NIL)'
+NOTES = b'("text" "plain" ("name" "notes.txt") NIL NIL "base64" 300 5 NIL ("attachment" ("filename" "notes.txt")) NIL)'
+
+
+def test_nested_alternative_inside_mixed():
+    structure = b"((" + PLAIN + HTML + b' "alternative" ("boundary" "a") NIL NIL)' + PDF + b' "mixed" ("boundary" "m") NIL NIL)'
+    assert text_part(structure) == {
+        "section": "1.1", "subtype": "plain", "charset": "utf-8", "encoding": "7bit", "size": 120,
+    }
+
+
+def test_text_attachment_is_skipped_for_html():
+    structure = b"(" + NOTES + b"(" + HTML + PDF + b' "related" NIL NIL NIL) "mixed" NIL NIL NIL)'
+    part = text_part(structure)
+    assert (part["section"], part["subtype"], part["charset"]) == ("2.1", "html", "windows-1252")
+
+
+def test_single_part_message_is_section_one():
+    assert text_part(PLAIN)["section"] == "1"
+
+
+def test_attachments_only_has_no_text_part():
+    assert text_part(b"(" + PDF + NOTES + b' "mixed" NIL NIL NIL)') is None
+
+
+def test_missing_bodystructure_raises():
+    with pytest.raises(ValueError):
+        find_text_part(b"* 1 FETCH (UID 1 RFC822.SIZE 10)", [])
+
+
+def test_fetch_matching_downloads_only_the_text_part_of_wanted_mail():
+    headers = (header_response(1, 5, b"From: a@x.com\r\nSubject: hi\r\n\r\n")
+               + header_response(2, 6, b"From: spam@y.com\r\nSubject: buy\r\n\r\n"))
+    bodies = b"* 1 FETCH (UID 5 BODY[1]<0> " + literal(b"hello there") + b")\r\n"
+    conn = FakeConn(headers, bodies)
+
+    fetched = list(fetch_matching(conn, [b"5", b"6"], lambda h: h["from"].endswith("@x.com")))
+
+    assert len(conn.sent) == 2
+    assert b"UID FETCH 5 (UID BODY.PEEK[1]<0." in conn.sent[1]
+    [(h, raw)] = fetched
+    assert h["id"] == b"5"
+    assert raw.startswith(b"From: a@x.com\r\nSubject: hi\r\nContent-Type: text/plain")
+    assert raw.endswith(b"\r\n\r\nhello there")
+
+
+def test_lost_claims_are_neither_downloaded_nor_ledgered():
+    class Claims:
+        def claim(self, conn, uids):
+            return [uid for uid in uids if uid != b"6"]
+
+    class Ledger:
+        def __init__(self):
+            self.recorded = []
+
+        def filter_new(self, uidvalidity, uids):
+            return uids
+
+        def record(self, uidvalidity, uids, state):
+            self.recorded.append((list(uids), state))
+
+    headers = (header_response(1, 5, b"From: a@x.com\r\n\r\n") + header_response(2, 6, b"From: b@x.com\r\n\r\n"))
+    bodies = b"* 1 FETCH (UID 5 BODY[1]<0> " + literal(b"mine") + b")\r\n"
+    conn = FakeConn(headers, bodies)
+    ledger = Ledger()
+
+    fetched = list(fetch_matching(conn, [b"5", b"6"], lambda h: True, ledger=ledger, claims=Claims()))
+
+    assert [h["id"] for h, _ in fetched] == [b"5"]
+    assert conn.sent[1].split(b" UID FETCH ")[1].startswith(b"5 ")
+    # A lost claim may go stale and be taken over later, so it mustn't be ledgered as handled
+    assert ledger.recorded == [([], "ignored")]
+
+
+def test_unsolicited_flag_updates_are_not_bodies():
+    headers = header_response(1, 5, b"From: a@x.com\r\n\r\n") + header_response(2, 6, b"From: b@x.com\r\n\r\n",
+                                                                               structure=b"NIL")
+    bodies = (b"* 1 FETCH (UID 5 FLAGS (\\Seen))\r\n"
+              b"* 1 FETCH (UID 5 BODY[1]<0> " + literal(b"hello there") + b")\r\n"
+              b"* 1 FETCH (UID 5 BODY[1]<0> " + literal(b"hello again") + b")\r\n")
+    whole = (b"* 2 FETCH (FLAGS (\\Seen) UID 6)\r\n"
+             b"* 2 FETCH (UID 6 RFC822 " + literal(b"Subject: b\r\n\r\nfull") + b")\r\n")
+    conn = FakeConn(headers, bodies, whole)
+
+    fetched = [(h["id"], raw) for h, raw in fetch_matching(conn, [b"5", b"6"], lambda h: True)]
+
+    assert [uid for uid, _ in fetched] == [b"5", b"6"]
+    assert fetched[0][1].endswith(b"hello there")
+    assert fetched[1][1].endswith(b"full")
@@ -0,0 +1,83 @@
+from mail_sync import MailboxSync, mailbox_status
+
+
+class FakeMailbox:
+    """STATUS and UID SEARCH over a set of unread UIDs."""
+
+    def __init__(self, uidvalidity=7, unseen=()):
+        self.uidvalidity = uidvalidity
+        self.unseen = set(unseen)
+        self.uidnext = max(self.unseen, default=0) + 1
+        self.searches = []
+
+    def arrive(self, *uids):
+        self.unseen.update(uids)
+        self.uidnext = max(self.uidnext, max(uids) + 1)
+
+    def status(self, mailbox, items):
+        return "OK", [b"INBOX (UIDVALIDITY %d UIDNEXT %d)" % (self.uidvalidity, self.uidnext)]
+
+    def uid(self, command, charset, criteria):
+        self.searches.append(criteria)
+        low = int(criteria.split()[1].split(":")[0]) if criteria.startswith("UID") else 1
+        # Like a real server, "n:*" always includes the highest UID
+        matches = {uid for uid in self.unseen if uid >= low} | ({self.uidnext - 1} if criteria.startswith("UID") else set())
+        return "OK", [b" ".join(b"%d" % uid for uid in sorted(matches))]
+
+
+def new(sync, conn):
+    return [int(uid) for uid in sync.new_uids(conn)]
+
+
+def test_mailbox_status():
+    assert mailbox_status(FakeMailbox(uidvalidity=3, unseen=[9])) == (3, 10)
+
+
+def test_only_the_delta_is_searched(tmp_path):
+    conn = FakeMailbox(unseen=[1, 2, 3])
+    sync = MailboxSync(str(tmp_path / "sync.json"))
+    assert new(sync, conn) == [1, 2, 3]
+    sync.finish(history_id=100)
+
+    assert new(sync, conn) == []
+    assert conn.searches == ["UNSEEN"]  # Nothing new: STATUS only
+    conn.unseen.discard(3)  # Read elsewhere; still the highest UID
+    conn.arrive(5)
+    assert new(sync, conn) == [5]
+    assert conn.searches[-1] == "UID 4:* UNSEEN"
+
+
+def test_state_survives_restart_and_stale_history_ids(tmp_path):
+    path = str(tmp_path / "sync.json")
+    conn = FakeMailbox(unseen=[1, 2])
+    sync = MailboxSync(path)
+    new(sync, conn)
+    sync.finish(history_id=100)
+
+    restarted = MailboxSync(path)
+    assert restarted.is_stale(99) and restarted.is_stale("100") and not restarted.is_stale(101)
+    assert new(restarted, conn) == []
+
+
+def test_unresolved_uids_are_searched_again(tmp_path):
+    conn = FakeMailbox(unseen=[1, 2, 3, 4])
+    sync = MailboxSync(str(tmp_path / "sync.json"))
+    assert new(sync, conn) == [1, 2, 3, 4]
+    sync.finish(unresolved=[b"3"])  # e.g. its reply failed
+
+    conn.arrive(6)
+    assert new(sync, conn) == [3, 4, 6]
+    conn.unseen -= {3, 4}  # Answered this time
+    sync.finish()
+    assert new(sync, conn) == []
+
+
+def test_uidvalidity_change_rescans(tmp_path):
+    conn = FakeMailbox(unseen=[1, 2])
+    sync = MailboxSync(str(tmp_path / "sync.json"))
+    new(sync, conn)
+    sync.finish()
+
+    conn.uidvalidity = 8
+    assert new(sync, conn) == [1, 2]
+    assert conn.searches[-1] == "UNSEEN"
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+import memory_index
+from conversation_store import ConversationStore
+
+pytestmark = pytest.mark.skipif(not memory_index.AVAILABLE, reason="numpy is not installed")
+
+
+def test_catch_up_embeds_only_missing_turns(tmp_path):
+    store = ConversationStore(str(tmp_path / "memory.db"))
+    old = store.append("Friend@x.com", "boats", [("user", "my ship has red sails"), ("assistant", "fine sails")])
+    index = memory_index.VectorIndex(str(tmp_path / "index"), memory_index.HashingEmbedder())
+    new = store.append("friend@x.com", "boats", [("user", "the anchor is rusty"), ("assistant", "polish it")])
+    index.add("friend@x.com", list(zip(new, ["the anchor is rusty", "polish it"])))
+
+    assert index.catch_up(store, chunk=1) == 2
+    assert index.indexed_ids() == set(old + new)
+    assert index.catch_up(store) == 0
+    assert index.search("friend@x.com", "red sails", k=1)[0][0] == old[0]
+
+
+def test_openai_embedder_waits_on_the_shared_limiter():
+    class Limiter:
+        def __init__(self, allow):
+            self.allow, self.charged = allow, []
+
+        def acquire(self, tokens, timeout):
+            self.charged.append((tokens, timeout))
+            return tokens if self.allow else False
+
+    class Client:
+        def with_options(self, timeout):
+            self.timeout = timeout
+            return self
+
+        @property
+        def embeddings(self):
+            return SimpleNamespace(create=lambda model, input: SimpleNamespace(
+                data=[SimpleNamespace(embedding=[3.0, 4.0]) for _ in input]))
+
+    client, limiter = Client(), Limiter(allow=True)
+    vectors = memory_index.OpenAIEmbedder(client, dim=2, limiter=limiter, timeout=5).embed(["ahoy there"])
+    assert vectors.tolist() == [[pytest.approx(0.6), pytest.approx(0.8)]] and client.timeout == 5 and limiter.charged[0][1] == 5
+
+    with pytest.raises(TimeoutError):
+        memory_index.OpenAIEmbedder(Client(), dim=2, limiter=Limiter(allow=False)).embed(["ahoy"])
@@ -0,0 +1,59 @@
+import threading
+import time
+
+from digest import DigestBatcher
+from pipeline import Pipeline, Stage
+
+
+def digest_pipeline(sent, window=0.1, max_items=10, parse=lambda item: item):
+    return Pipeline([
+        Stage("parse", parse, workers=2),
+        DigestBatcher(lambda item: item[0], window=window, max_items=max_items),
+        Stage("generate", lambda group: (group[0][0], [body for _, body in group])),
+        Stage("send", sent.append),
+    ])
+
+
+def test_join_waits_for_the_digest_window():
+    sent = []
+    pipeline = digest_pipeline(sent)
+    for item in [("ann", 1), ("bob", 2), ("ann", 3), ("ann", 4)]:
+        pipeline.submit(item)
+
+    start = time.monotonic()
+    pipeline.join()
+
+    assert time.monotonic() - start >= 0.05
+    assert sorted((sender, sorted(bodies)) for sender, bodies in sent) == [("ann", [1, 3, 4]), ("bob", [2])]
+    digest = pipeline.stats()["digest"]
+    assert digest["digests"] == 2 and digest["calls_saved"] == 2 and digest["waiting_groups"] == 0
+
+
+def test_full_group_is_handed_on_before_the_window():
+    sent = []
+    pipeline = digest_pipeline(sent, window=60, max_items=2)
+    pipeline.submit(("ann", 1))
+    pipeline.submit(("ann", 2))
+
+    done = threading.Thread(target=pipeline.join, daemon=True)
+    done.start()
+    done.join(2)
+
+    assert not done.is_alive()
+    assert sent == [("ann", [1, 2])]
+
+
+def test_failed_and_dropped_items_do_not_block_join():
+    def parse(item):
+        if item[1] == 2:
+            raise ValueError("bad mail")
+        return None if item[1] == 3 else item
+
+    sent = []
+    pipeline = digest_pipeline(sent, window=0.01, parse=parse)
+    for item in [("ann", 1), ("ann", 2), ("ann", 3)]:
+        pipeline.submit(item)
+    pipeline.join()
+
+    assert sent == [("ann", [1])]
+    assert pipeline.stats()["parse"]["errors"] == 1 and pipeline.stats()["parse"]["processed"] == 2
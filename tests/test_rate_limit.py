@@ -0,0 +1,133 @@
+import time
+
+import pytest
+
+from rate_limit import DailyQuota, OpenAILimiter, TokenBucket, chat_completion, parse_duration
+
+
+def test_parse_duration():
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("120ms") == pytest.approx(0.12)
+    assert parse_duration(None) == 0
+
+
+def test_bucket_bursts_to_capacity_then_refills():
+    bucket = TokenBucket(rate=100, capacity=3)
+    assert all(bucket.acquire(timeout=0) for _ in range(3))
+    assert bucket.acquire(timeout=0) is False
+
+    start = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert 0.005 <= time.monotonic() - start < 0.5
+
+
+def test_bucket_gives_up_when_the_wait_would_overrun_the_timeout():
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.acquire()
+    start = time.monotonic()
+    assert bucket.acquire(timeout=0.1) is False
+    assert time.monotonic() - start < 0.1
+
+
+def test_paused_bucket_waits_out_the_pause():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    bucket.pause(0.05)
+    assert bucket.acquire(timeout=0.01) is False
+    assert bucket.acquire(timeout=1)
+
+
+def test_limiter_charges_prompt_and_expected_reply_tokens():
+    limiter = OpenAILimiter(requests_per_minute=600, tokens_per_minute=600, completion_tokens=40)
+    assert limiter.acquire(60) == 100
+    assert limiter.tokens.level == pytest.approx(0, abs=1)
+
+    # The reply was shorter than expected: the difference goes back in the bucket
+    limiter.update({}, charged=100, used=70)
+    assert limiter.tokens.level == pytest.approx(30, abs=1)
+
+
+def test_limiter_follows_rate_limit_headers():
+    limiter = OpenAILimiter(requests_per_minute=6000, tokens_per_minute=60000)
+    limiter.update({"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0"})
+
+    assert limiter.ceilings["requests"] == 1
+    assert limiter.requests.rate == 1
+    assert limiter.acquire(10, timeout=0.05) is False
+
+
+def test_429_halves_the_rates_and_pauses():
+    limiter = OpenAILimiter(requests_per_minute=600, tokens_per_minute=6000)
+    limiter.on_rate_limited({"x-ratelimit-reset-requests": "50ms", "retry-after": "0.02"})
+
+    assert limiter.stats()["requests_per_minute"] == 300 and limiter.stats()["tokens_per_minute"] == 3000
+    assert limiter.stats()["throttled"] == 1
+    assert limiter.acquire(0, timeout=0.01) is False
+
+    # Each success creeps 5% of the ceiling back
+    limiter.update({})
+    assert limiter.stats()["requests_per_minute"] == 330
+
+
+class FakeRawResponse:
+    headers = {"x-ratelimit-remaining-requests": "99", "x-ratelimit-remaining-tokens": "5000"}
+
+    class usage:
+        total_tokens = 12
+
+    def parse(self):
+        return self
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.options = None
+        self.chat = self
+        self.completions = self
+        self.with_raw_response = self
+
+    def with_options(self, **options):
+        self.options = options
+        return self
+
+    def create(self, **kwargs):
+        if self.error:
+            raise self.error
+        return FakeRawResponse()
+
+
+def test_chat_completion_refunds_unused_tokens():
+    limiter = OpenAILimiter(requests_per_minute=600, tokens_per_minute=60000, completion_tokens=100)
+    client = FakeClient()
+    completion = chat_completion(client, limiter, 5, model="m", messages=[{"role": "user", "content": "hi"}])
+
+    assert completion.usage.total_tokens == 12
+    assert client.options["max_retries"] == 0 and 0 < client.options["timeout"] <= 5
+    # The server's remaining counts cap the buckets, then the unused reply tokens come back
+    assert limiter.requests.level <= 99
+    assert 5000 < limiter.tokens.level < 5100
+
+
+def test_chat_completion_429_slows_the_limiter():
+    class RateLimited(Exception):
+        status_code = 429
+
+    limiter = OpenAILimiter()
+    with pytest.raises(RateLimited):
+        chat_completion(FakeClient(RateLimited()), limiter, 5, model="m", messages=[])
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_daily_quota_is_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "quota.db")
+    DailyQuota(2, path).acquire()
+    quota = DailyQuota(2, path)
+    quota.acquire()
+
+    assert quota.used() == 2
+    assert quota._take() is False
+
+    roomy = DailyQuota(5, path)
+    roomy.exhaust()
+    assert roomy.used() == 5 and roomy._take() is False
@@ -0,0 +1,60 @@
+import pytest
+
+from reply_parser import clean_reply_text, estimate_tokens, strip_reply
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_gmail_quote_and_signature_are_removed():
+    text = ("Sounds grand, see you Friday!\r\n\r\n-- \r\nAnn\r\n\r\n"
+            "On Mon, 3 Mar 2025 at 10:00, Sir Peepius <peep@x.com> wrote:\r\n"
+            "> Shall we meet for tea?\r\n> Huzzah!\r\n")
+    cleaned, removed = strip_reply(text)
+    assert cleaned == "Sounds grand, see you Friday!"
+    assert removed == estimate_tokens(text) - estimate_tokens(cleaned)
+
+
+def test_wrapped_wrote_line_is_cut():
+    text = "Yes please.\n\nOn Mon, 3 Mar 2025 at 10:00, Sir Peepius\n<peep@x.com> wrote:\n> Tea?\n"
+    assert strip_reply(text)[0] == "Yes please."
+
+
+@pytest.mark.parametrize("separator", [
+    "-----Original Message-----",
+    "---------- Forwarded message ---------",
+    "Begin forwarded message:",
+    "________________________________",
+    "From: Sir Peepius <peep@x.com>\nSent: Monday, March 3, 2025 10:00 AM",
+    "Le lun. 3 mars 2025 à 10:00, Sir Peepius <peep@x.com> a écrit :",
+    "Am Mo., 3. März 2025 um 10:00 Uhr schrieb Sir Peepius <peep@x.com>:",
+])
+def test_earlier_mail_is_cut(separator):
+    text = f"Thanks, sir.\n\n{separator}\nSubject: tea\n\nShall we meet?\n"
+    assert strip_reply(text)[0] == "Thanks, sir."
+
+
+def test_inline_replies_keep_the_new_lines():
+    text = "> Tea on Friday?\nYes!\n> Earl Grey?\nLapsang, please.\n\nSent from my iPhone\n"
+    assert strip_reply(text)[0] == "Yes!\nLapsang, please."
+
+
+def test_disclaimer_is_dropped():
+    text = "Invoice attached.\n\nCONFIDENTIALITY NOTICE: this message is for the named recipient only.\n"
+    assert strip_reply(text)[0] == "Invoice attached."
+
+
+def test_bare_forward_falls_back_to_the_original():
+    text = "---------- Forwarded message ---------\nFrom: a@x.com\n\nRead this!\n"
+    assert strip_reply(text) == (text, 0)
+    assert strip_reply("") == ("", 0)
+
+
+def test_clean_reply_text_logs_the_saving(capsys):
+    assert clean_reply_text("Hi\n> old\n> older\n> oldest\n") == "Hi"
+    assert "Trimmed" in capsys.readouterr().out
+    assert clean_reply_text("Just this.") == "Just this."
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,44 @@
+from sender_match import SenderMatcher
+
+
+def test_exact_domain_and_subdomain_entries():
+    matcher = SenderMatcher(["Friend@Example.com", "@crew.org", "harbour.net", "@.fleet.io"])
+    assert matcher.check('"A Friend" <friend@example.COM>') == (True, "friend@example.COM")
+    assert matcher.matches("stranger@example.com") is False
+    assert matcher.matches("mate@crew.org") and matcher.matches("pilot@harbour.net")
+    assert matcher.matches("cook@ship.fleet.io") and matcher.matches("cook@a.b.fleet.io")
+    assert not matcher.matches("cook@fleet.io")  # @.domain is subdomains only
+    assert not matcher.matches("mate@notcrew.org")
+    assert len(matcher) == 4
+
+
+def test_deny_list_wins():
+    matcher = SenderMatcher(["@crew.org"], deny=["bilge@crew.org", "@.spam.crew.org"])
+    assert matcher.matches("mate@crew.org")
+    assert matcher.check("Bilge <BILGE@crew.org>") == (False, "BILGE@crew.org")
+    assert not matcher.matches("x@lots.spam.crew.org")
+
+
+def test_targets_file_alone_is_enough(tmp_path, monkeypatch):
+    targets = tmp_path / "targets.txt"
+    targets.write_text("# crew\nfriend@example.com\n\n@crew.org\n")
+    monkeypatch.delenv("TARGET_EMAILS", raising=False)
+    monkeypatch.delenv("DENY_EMAILS", raising=False)
+    monkeypatch.delenv("DENY_EMAILS_FILE", raising=False)
+    monkeypatch.setenv("TARGET_EMAILS_FILE", str(targets))
+
+    matcher = SenderMatcher.from_env()
+    assert len(matcher) == 2
+    assert matcher.matches("friend@example.com") and matcher.matches("mate@crew.org")
+
+
+def test_env_list_and_file_are_combined(tmp_path, monkeypatch):
+    targets = tmp_path / "targets.txt"
+    targets.write_text("b@y.com\n")
+    monkeypatch.setenv("TARGET_EMAILS", "a@x.com, c@z.com")
+    monkeypatch.setenv("TARGET_EMAILS_FILE", str(targets))
+    monkeypatch.setenv("DENY_EMAILS", "c@z.com")
+    monkeypatch.delenv("DENY_EMAILS_FILE", raising=False)
+
+    matcher = SenderMatcher.from_env()
+    assert [matcher.matches(a) for a in ("a@x.com", "b@y.com", "c@z.com")] == [True, True, False]
@@ -0,0 +1,27 @@
+from uid_ledger import UIDLedger
+
+
+def test_recorded_uids_are_filtered_and_survive_restart(tmp_path):
+    path = str(tmp_path / "uids.db")
+    UIDLedger(path).record(7, [b"1", b"3"], "ignored")
+    assert UIDLedger(path).filter_new(7, [b"1", b"2", b"3"]) == [b"2"]
+
+
+def test_new_uidvalidity_forgets_old_uids(tmp_path):
+    ledger = UIDLedger(str(tmp_path / "uids.db"))
+    ledger.record(7, [b"1"], "answered")
+    ledger.record(8, [b"2"], "answered")
+    assert ledger.filter_new(7, [b"1"]) == [b"1"]
+
+
+def test_failures_are_given_up_on_after_max_attempts(tmp_path):
+    path = str(tmp_path / "uids.db")
+    ledger = UIDLedger(path)
+    assert ledger.record_failure(7, [b"5", b"6"], max_attempts=3) == []
+    assert ledger.record_failure(7, [b"5"], max_attempts=3) == []
+    assert ledger.filter_new(7, [b"5", b"6"]) == [b"5", b"6"]
+
+    # Attempts are counted across restarts
+    assert UIDLedger(path).record_failure(7, [b"5", b"6"], max_attempts=3) == [b"5"]
+    assert UIDLedger(path).filter_new(7, [b"5", b"6"]) == [b"6"]
+
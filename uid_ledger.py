@@ -0,0 +1,108 @@
+"""
+Sir Peepius UID Ledger
+A small SQLite file remembering which UIDs have already been looked at
+(ignored or answered), keyed by UIDVALIDITY, so unread mail we never reply
+to is not re-fetched on every poll. It also counts failed replies, so a
+message that keeps failing is given up on instead of retried forever.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+DEFAULT_LEDGER_FILE = os.path.join(tempfile.gettempdir(), "sir_peepius_uids.db")
+
+
+class UIDLedger:
+    """Durable set of (uidvalidity, uid) pairs with an in-memory cache for O(1) lookups."""
+
+    def __init__(self, path=DEFAULT_LEDGER_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS seen_uids ("
+            " uidvalidity INTEGER NOT NULL,"
+            " uid INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " recorded_at REAL NOT NULL,"
+            " PRIMARY KEY (uidvalidity, uid)"
+            ") WITHOUT ROWID"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS failed_attempts ("
+            " uidvalidity INTEGER NOT NULL,"
+            " uid INTEGER NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " PRIMARY KEY (uidvalidity, uid)"
+            ") WITHOUT ROWID"
+        )
+        self._db.commit()
+        self._known = {}  # uidvalidity -> set of uids
+
+    def _known_uids(self, uidvalidity):
+        known = self._known.get(uidvalidity)
+        if known is None:
+            rows = self._db.execute(
+                "SELECT uid FROM seen_uids WHERE uidvalidity = ?", (uidvalidity,)
+            )
+            known = self._known[uidvalidity] = {uid for (uid,) in rows}
+        return known
+
+    def filter_new(self, uidvalidity, uids):
+        """Return only the UIDs the ledger has never recorded."""
+        if uidvalidity is None:
+            return list(uids)
+        with self._lock:
+            known = self._known_uids(uidvalidity)
+            return [uid for uid in uids if int(uid) not in known]
+
+    def record(self, uidvalidity, uids, status):
+        """Remember UIDs as handled (e.g. "ignored" or "answered")."""
+        if uidvalidity is None or not uids:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO seen_uids VALUES (?, ?, ?, ?)",
+                [(uidvalidity, int(uid), status, now) for uid in uids],
+            )
+            # A new UIDVALIDITY means old UIDs can never come back
+            self._db.execute("DELETE FROM seen_uids WHERE uidvalidity != ?", (uidvalidity,))
+            self._db.execute("DELETE FROM failed_attempts WHERE uidvalidity != ?", (uidvalidity,))
+            self._db.executemany(
+                "DELETE FROM failed_attempts WHERE uidvalidity = ? AND uid = ?",
+                [(uidvalidity, int(uid)) for uid in uids],
+            )
+            self._db.commit()
+            self._known = {uidvalidity: self._known_uids(uidvalidity)}
+            self._known[uidvalidity].update(int(uid) for uid in uids)
+
+    def record_failure(self, uidvalidity, uids, max_attempts):
+        """
+        Count one more failed reply for each UID. The ones that have now failed
+        max_attempts times are recorded as "failed" (so they're left alone
+        from then on) and returned.
+        """
+        if uidvalidity is None or not uids:
+            return []
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO failed_attempts VALUES (?, ?, 1)"
+                " ON CONFLICT (uidvalidity, uid) DO UPDATE SET attempts = attempts + 1",
+                [(uidvalidity, int(uid)) for uid in uids],
+            )
+            self._db.commit()
+            exhausted = {uid for (uid,) in self._db.execute(
+                "SELECT uid FROM failed_attempts WHERE uidvalidity = ? AND attempts >= ?",
+                (uidvalidity, max_attempts),
+            )}
+        given_up = [uid for uid in uids if int(uid) in exhausted]
+        self.record(uidvalidity, given_up, "failed")
+        return given_up
+
+    def stats(self):
+        with self._lock:
+            return {v: len(uids) for v, uids in self._known.items()}